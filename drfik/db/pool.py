@@ -0,0 +1,86 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+import threading
+import time
+
+from django.db.utils import OperationalError
+
+
+class ConnectionPool(object):
+    """
+    Holds at most ``size`` connections of one process to one database.
+
+    A thread asking for a connection while all of them are in use waits
+    up to ``timeout`` seconds for one to be put back. A connection that
+    has been idle for more than ``check_after`` seconds is passed to
+    ``check`` before it is reused, and replaced when the check fails.
+    """
+
+    def __init__(self, size, timeout=10, check=None, check_after=30):
+        self.size = size
+        self.timeout = timeout
+        self.check = check
+        self.check_after = check_after
+        self.idle = []
+        self.in_use = 0
+        self._cond = threading.Condition()
+
+    def get(self, connect):
+        """
+        Returns a ``(connection, reused)`` tuple, opening the connection
+        with ``connect()`` when there is no idle one.
+        """
+        deadline = time.time() + self.timeout
+        with self._cond:
+            while self.in_use >= self.size:
+                remaining = deadline - time.time()
+                if remaining <= 0:
+                    raise OperationalError(
+                        'All {} pooled connections are in use'.format(self.size)
+                    )
+                self._cond.wait(remaining)
+            self.in_use += 1
+            idle = self.idle.pop() if self.idle else None
+
+        try:
+            if idle is not None:
+                connection, since = idle
+                if (time.time() - since < self.check_after or
+                        self.check is None or self.check(connection)):
+                    return connection, True
+                self._discard(connection)
+            return connect(), False
+        except Exception:
+            self._release()
+            raise
+
+    def put(self, connection, discard=False):
+        if discard:
+            self._discard(connection)
+        with self._cond:
+            if not discard:
+                self.idle.append((connection, time.time()))
+            self.in_use -= 1
+            self._cond.notify()
+
+    def close(self):
+        """
+        Closes the idle connections, the ones in use are left alone.
+        """
+        with self._cond:
+            idle, self.idle = self.idle, []
+        for connection, _ in idle:
+            self._discard(connection)
+
+    def _release(self):
+        with self._cond:
+            self.in_use -= 1
+            self._cond.notify()
+
+    @staticmethod
+    def _discard(connection):
+        try:
+            connection.close()
+        except Exception:
+            pass
@@ -0,0 +1,36 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.core.signals import request_started
+from django.db import connections
+from django.db.backends.postgresql import base
+
+
+class DatabaseWrapper(base.DatabaseWrapper):
+    """
+    Postgres backend for persistent connections (CONN_MAX_AGE > 0).
+
+    Django only notices a dead persistent connection, e.g. after a server
+    restart or a failover, once a query has failed on it. This backend
+    runs ``SELECT 1`` before the first query of every request on a reused
+    connection, and reconnects when it fails.
+    """
+    health_check_pending = False
+
+    def ensure_connection(self):
+        if self.health_check_pending:
+            self.health_check_pending = False
+            if (self.connection is not None and
+                    not self.in_atomic_block and
+                    not self.is_usable()):
+                self.close()
+        super(DatabaseWrapper, self).ensure_connection()
+
+
+def schedule_health_checks(**kwargs):
+    for connection in connections.all():
+        if isinstance(connection, DatabaseWrapper):
+            connection.health_check_pending = True
+
+
+request_started.connect(schedule_health_checks)
@@ -0,0 +1,93 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+import os
+import threading
+
+from django.db.backends.postgresql import creation
+from psycopg2 import Error as DatabaseError
+from psycopg2.extensions import TRANSACTION_STATUS_IDLE
+
+from drfik.db.pool import ConnectionPool
+from drfik.db.postgresql import base
+
+_pools = {}
+_pools_lock = threading.Lock()
+
+
+def get_pool(key, factory):
+    # keyed by pid too: a pool must not be shared with forked workers
+    key = (os.getpid(), key)
+    with _pools_lock:
+        if key not in _pools:
+            _pools[key] = factory()
+        return _pools[key]
+
+
+def close_pools():
+    with _pools_lock:
+        pools = list(_pools.values())
+    for pool in pools:
+        pool.close()
+
+
+def is_alive(connection):
+    try:
+        connection.cursor().execute('SELECT 1')
+    except DatabaseError:
+        return False
+    return True
+
+
+class DatabaseCreation(creation.DatabaseCreation):
+
+    def _destroy_test_db(self, test_database_name, verbosity):
+        # idle pooled connections would keep the test database in use
+        close_pools()
+        super(DatabaseCreation, self)._destroy_test_db(test_database_name, verbosity)
+
+
+class DatabaseWrapper(base.DatabaseWrapper):
+    """
+    Postgres backend that keeps at most ``POOL['SIZE']`` connections per
+    process and database. Closing a connection, which Django does at the
+    end of every request when CONN_MAX_AGE is 0, puts it back into the
+    pool instead. When all of them are in use, a request waits up to
+    ``POOL['TIMEOUT']`` seconds for one.
+    """
+    creation_class = DatabaseCreation
+
+    def get_new_connection(self, conn_params):
+        options = self.settings_dict.get('POOL', {})
+        self.pool = get_pool(
+            tuple(sorted(conn_params.items())),
+            lambda: ConnectionPool(
+                size=options.get('SIZE', 4),
+                timeout=options.get('TIMEOUT', 10),
+                check=is_alive,
+                check_after=options.get('CHECK_AFTER', 30),
+            )
+        )
+        connection, reused = self.pool.get(
+            lambda: super(DatabaseWrapper, self).get_new_connection(conn_params)
+        )
+        if reused:
+            # set by the parent for the connections it opens
+            self.isolation_level = self.settings_dict['OPTIONS'].get(
+                'isolation_level', connection.isolation_level
+            )
+        return connection
+
+    def _close(self):
+        if self.connection is None:
+            return
+        # Django keeps the object of a connection closed inside a
+        # transaction, so it must not go to another thread
+        discard = self.connection.closed or self.in_atomic_block
+        if not discard:
+            try:
+                if self.connection.get_transaction_status() != TRANSACTION_STATUS_IDLE:
+                    self.connection.rollback()
+            except DatabaseError:
+                discard = True
+        self.pool.put(self.connection, discard)
@@ -0,0 +1,38 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.conf import settings
+from django.db.backends.sqlite3 import base
+
+
+class DatabaseWrapper(base.DatabaseWrapper):
+    """
+    sqlite backend tuned for several worker processes sharing the file.
+
+    Every new connection runs ``SQLITE_PRAGMAS``, and ``PRAGMA
+    query_only`` when the alias sets ``READ_ONLY``.
+
+    Transactions start with BEGIN IMMEDIATE. With a plain BEGIN a
+    transaction that reads before it writes fails at once with "database
+    is locked" when another process committed in between, because
+    busy_timeout cannot help it. Taking the write lock up front makes
+    it wait for its turn instead.
+    """
+
+    def get_new_connection(self, conn_params):
+        conn = super(DatabaseWrapper, self).get_new_connection(conn_params)
+        for name, value in getattr(settings, 'SQLITE_PRAGMAS', {}).items():
+            conn.execute('PRAGMA {} = {}'.format(name, value))
+        if self.settings_dict.get('READ_ONLY'):
+            conn.execute('PRAGMA query_only = 1')
+        return conn
+
+    def _start_transaction_under_autocommit(self):
+        # on the raw connection, like the implicit BEGIN of postgres, so
+        # that it is not counted as a query of the request: a save in
+        # autocommit mode would cost one more query on sqlite than in
+        # the test suite, where it runs inside the test's transaction
+        if self.settings_dict.get('READ_ONLY'):
+            self.connection.execute('BEGIN')
+        else:
+            self.connection.execute('BEGIN IMMEDIATE')
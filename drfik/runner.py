@@ -0,0 +1,28 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+import shutil
+import tempfile
+
+from django.conf import settings
+from django.test.runner import DiscoverRunner
+
+
+class TestRunner(DiscoverRunner):
+    """
+    Runs the tests with METRICS_DIR in a temporary directory, removed
+    afterwards, so that they neither read the timings of the processes of
+    the deployment nor leave theirs behind.
+    """
+
+    def setup_test_environment(self, **kwargs):
+        super(TestRunner, self).setup_test_environment(**kwargs)
+        self.metrics_dir = tempfile.mkdtemp(prefix='drfik-test-metrics-')
+        settings.METRICS_DIR = self.metrics_dir
+
+    def teardown_test_environment(self, **kwargs):
+        shutil.rmtree(self.metrics_dir, ignore_errors=True)
+        # not the directory of the deployment: the timings of this process
+        # are not written at exit
+        settings.METRICS_DIR = ''
+        super(TestRunner, self).teardown_test_environment(**kwargs)
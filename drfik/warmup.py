@@ -0,0 +1,174 @@
+# -*- coding: utf-8 -*-
+"""
+Primes the caches that the first requests of a worker would otherwise
+fill: compiled URL patterns, DRF settings and serializers, templates,
+password hashers and translations.
+
+drfik/wsgi.py runs it when the application is loaded. Under
+``gunicorn --preload`` that happens once in the master process, and the
+workers forked from it share the primed state copy-on-write.
+No database connection is opened, a connection made before the fork
+would be shared by every worker.
+"""
+from __future__ import unicode_literals
+
+import sys
+import time
+from collections import Counter
+
+from django.utils.six.moves import builtins
+
+TEMPLATES = (
+    'confirmation_email.html',
+    'invite_email.html',
+    'rest_framework/api.html',
+)
+
+
+class ImportTimer(object):
+    """
+    Measures the time spent importing modules while active, by top-level
+    package. Time spent importing another package from inside a package
+    is counted for the other package only.
+    """
+
+    def __init__(self):
+        self.totals = Counter()
+        self._nested = []
+
+    def __enter__(self):
+        self._import = builtins.__import__
+        builtins.__import__ = self.timed_import
+        return self
+
+    def __exit__(self, *exc_info):
+        builtins.__import__ = self._import
+
+    def timed_import(self, name, *args, **kwargs):
+        level = args[3] if len(args) > 3 else kwargs.get('level', 0)
+        if level > 0 or name in sys.modules:
+            return self._import(name, *args, **kwargs)
+
+        started = time.time()
+        self._nested.append(0.0)
+        try:
+            return self._import(name, *args, **kwargs)
+        finally:
+            elapsed = time.time() - started
+            self.totals[name.split('.')[0]] += elapsed - self._nested.pop()
+            if self._nested:
+                self._nested[-1] += elapsed
+
+
+def _compile_patterns(resolver):
+    for pattern in resolver.url_patterns:
+        pattern.regex
+        if hasattr(pattern, 'url_patterns'):
+            _compile_patterns(pattern)
+
+
+def _views(resolver):
+    for pattern in resolver.url_patterns:
+        if hasattr(pattern, 'url_patterns'):
+            for view_class in _views(pattern):
+                yield view_class
+        else:
+            view_class = getattr(pattern.callback, 'view_class', None)
+            if view_class is not None:
+                yield view_class
+
+
+def warm_urls():
+    from django.urls import get_resolver
+
+    resolver = get_resolver()
+    _compile_patterns(resolver)
+    # builds the reverse and namespace dicts
+    resolver.reverse_dict
+    resolver.namespace_dict
+
+
+def warm_rest_framework():
+    from django.urls import get_resolver
+    from rest_framework.renderers import JSONRenderer
+    from rest_framework.settings import api_settings
+
+    for name in api_settings.defaults:
+        getattr(api_settings, name)
+    JSONRenderer().render({})
+    for view_class in _views(get_resolver()):
+        serializer_class = getattr(view_class, 'serializer_class', None)
+        if serializer_class is not None:
+            serializer_class().fields
+
+
+def warm_templates():
+    from django.template.loader import get_template
+
+    for name in TEMPLATES:
+        get_template(name)
+
+
+def warm_hashers():
+    from django.contrib.auth.hashers import get_hasher, get_hashers_by_algorithm
+
+    get_hashers_by_algorithm()
+    get_hasher('default')
+
+
+def warm_auth():
+    from importlib import import_module
+
+    from django.conf import settings
+    from django.contrib.auth import get_backends
+
+    import_module(settings.SESSION_ENGINE)
+    get_backends()
+
+
+def warm_translations():
+    from django.conf import settings
+    from django.utils import translation
+
+    with translation.override(settings.LANGUAGE_CODE):
+        translation.ugettext('This field is required.')
+
+
+STEPS = (
+    ('urls', warm_urls),
+    ('rest_framework', warm_rest_framework),
+    ('templates', warm_templates),
+    ('hashers', warm_hashers),
+    ('auth', warm_auth),
+    ('translations', warm_translations),
+)
+
+
+def warmup():
+    """
+    Runs every step and returns ``[(step, seconds)]``.
+    """
+    timings = []
+    for name, step in STEPS:
+        started = time.time()
+        step()
+        timings.append((name, time.time() - started))
+    return timings
+
+
+def report(imports, timings, limit=10):
+    """
+    Startup cost of the slowest imported packages and of every warmup
+    step, in milliseconds.
+    """
+    lines = ['Imports: {:.0f} ms'.format(sum(imports.totals.values()) * 1000)]
+    lines.extend(
+        '  {:<24} {:8.1f} ms'.format(name, seconds * 1000)
+        for name, seconds in imports.totals.most_common(limit)
+    )
+    lines.append('Warmup: {:.0f} ms'.format(sum(s for _, s in timings) * 1000))
+    lines.extend(
+        '  {:<24} {:8.1f} ms'.format(name, seconds * 1000)
+        for name, seconds in timings
+    )
+    return '\n'.join(lines)
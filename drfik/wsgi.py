@@ -5,14 +5,27 @@ It exposes the WSGI callable as a module-level variable named ``application``.
 
 For more information on this file, see
 https://docs.djangoproject.com/en/1.11/howto/deployment/wsgi/
+
+The caches the first requests would fill are primed by drfik.warmup
+when the application is loaded, once in the master process under
+``gunicorn --preload``. The import and warmup cost goes to stderr.
 """
 
 import os
+import sys
 
-from django.core.wsgi import get_wsgi_application
-from whitenoise.django import DjangoWhiteNoise
+from drfik.warmup import ImportTimer, report, warmup
 
 os.environ.setdefault("DJANGO_SETTINGS_MODULE", "drfik.settings")
 
-application = get_wsgi_application()
-application = DjangoWhiteNoise(application)
+with ImportTimer() as imports:
+    from django.conf import settings
+    from django.core.wsgi import get_wsgi_application
+    from whitenoise.django import DjangoWhiteNoise
+
+    application = get_wsgi_application()
+    application = DjangoWhiteNoise(application)
+
+    if getattr(settings, 'WARMUP', True):
+        # the steps include the modules they import, such as main.views
+        sys.stderr.write(report(imports, warmup()) + '\n')
@@ -0,0 +1,359 @@
+"""
+End-to-end load test for every route in main/urls.py.
+
+Runs the WSGI app from drfik/wsgi.py under gunicorn against a fresh sqlite
+database and a local SMTP sink, drives each endpoint with concurrent
+clients and reports requests/sec, latency percentiles and error rate per
+endpoint. Requires Python 3 and gunicorn.
+
+    python -m loadtest.run --clients 8 --requests 200 --output results.json
+"""
+import argparse
+import asyncore
+import http.client
+import json
+import os
+import shutil
+import smtpd
+import socket
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from collections import Counter, namedtuple
+from concurrent.futures import ThreadPoolExecutor
+
+BASE_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+PASSWORD = 'loadtest-password'
+
+Result = namedtuple('Result', 'status elapsed')
+
+
+class SmtpSink(smtpd.SMTPServer):
+    """
+    Accepts and drops every message, counting them.
+    """
+    received = 0
+
+    def process_message(self, peer, mailfrom, rcpttos, data, **kwargs):
+        self.received += 1
+
+
+class Client(object):
+    """
+    Minimal HTTP client with a cookie jar and JSON bodies.
+    """
+
+    def __init__(self, port):
+        self.port = port
+        self.cookies = {}
+        self.conn = None
+
+    def request(self, method, path, data=None, headers=None):
+        if self.conn is None:
+            self.conn = http.client.HTTPConnection('127.0.0.1', self.port, timeout=60)
+        all_headers = {'Content-Type': 'application/json'}
+        if self.cookies:
+            all_headers['Cookie'] = '; '.join(
+                '{}={}'.format(k, v) for k, v in self.cookies.items()
+            )
+        all_headers.update(headers or {})
+        body = json.dumps(data) if data is not None else None
+
+        started = time.perf_counter()
+        try:
+            self.conn.request(method, path, body, all_headers)
+            response = self.conn.getresponse()
+            response.read()
+        except (OSError, http.client.HTTPException):
+            self.conn.close()
+            self.conn = None
+            return Result(0, time.perf_counter() - started)
+        elapsed = time.perf_counter() - started
+
+        for header, value in response.getheaders():
+            if header.lower() == 'set-cookie':
+                name, _, value = value.split(';')[0].partition('=')
+                self.cookies[name] = value
+        return Result(response.status, elapsed)
+
+
+def bearer(token):
+    return {'Authorization': 'Bearer {}'.format(token)}
+
+
+def prepare_fixtures(requests, clients):
+    """
+    Creates the users, teams and tokens every scenario consumes, directly
+    through the ORM of the load-test database.
+    """
+    import django
+    django.setup()
+
+    from django.conf import settings
+    # the import is not part of the report, and the file written at exit
+    # would outlive the temporary directory
+    settings.METRICS_DIR = ''
+
+    from django.contrib.auth import get_user_model
+    from django.contrib.auth.hashers import make_password
+    from django.core.management import call_command
+    from django.utils.encoding import force_bytes
+    from django.utils.http import urlsafe_base64_encode
+
+    from main.models import Team
+    from main.token import api_token, forgot_token, registration_token
+
+    rows = []
+    password_hash = make_password(PASSWORD)
+
+    def add(prefix, count, **extra):
+        emails = ['{}{}@loadtest.local'.format(prefix, i) for i in range(count)]
+        rows.extend(dict(extra, email=e, password_hash=password_hash) for e in emails)
+        return emails
+
+    shared = add('shared', clients)
+    teamless = add('teamless', requests)
+    owners = add('owner', clients, team='loadtest')
+    inactive = add('inactive', requests, is_active=False)
+    resetting = add('resetting', requests)
+    add('member', 1000, team='loadtest')
+
+    path = os.path.join(os.environ['LOADTEST_DIR'], 'users.ndjson')
+    with open(path, 'w') as f:
+        f.write('\n'.join(json.dumps(row) for row in rows))
+    call_command('import_users', path, stdout=open(os.devnull, 'w'))
+
+    User = get_user_model()
+    users = dict((u.email, u) for u in User.objects.all())
+
+    def uid(user):
+        return urlsafe_base64_encode(force_bytes(user.pk)).decode()
+
+    staff = users[owners[0]]
+    staff.is_staff = True
+    staff.save()
+
+    return {
+        'shared': shared,
+        'shared_tokens': [api_token.make_token(users[e]) for e in shared],
+        'teamless_tokens': [api_token.make_token(users[e]) for e in teamless],
+        'owner_tokens': [api_token.make_token(users[e]) for e in owners],
+        'staff_token': api_token.make_token(staff),
+        'team_id': Team.objects.get(name='loadtest').pk,
+        'confirm': [
+            (uid(users[e]), registration_token.make_token(users[e]))
+            for e in inactive
+        ],
+        'forgot': [
+            (uid(users[e]), forgot_token.make_token(users[e]))
+            for e in resetting
+        ],
+    }
+
+
+def scenarios(fx):
+    """
+    Maps endpoint names to ``(expected statuses, call)``. ``call`` gets a
+    fresh client and the request number and returns the timed Result.
+    """
+    def shared(n):
+        return fx['shared'][n % len(fx['shared'])]
+
+    def shared_token(n):
+        return fx['shared_tokens'][n % len(fx['shared_tokens'])]
+
+    def owner_token(n):
+        return fx['owner_tokens'][n % len(fx['owner_tokens'])]
+
+    def logout(client, n):
+        client.request('POST', '/api/login/', {'email': shared(n), 'password': PASSWORD})
+        return client.request('GET', '/api/logout/')
+
+    team = '/api/teams/{}/'.format(fx['team_id'])
+    return {
+        'register': ((201, ), lambda c, n: c.request(
+            'POST', '/api/register/',
+            {'email': 'new{}@loadtest.local'.format(n), 'password': PASSWORD}
+        )),
+        'login': ((200, ), lambda c, n: c.request(
+            'POST', '/api/login/', {'email': shared(n), 'password': PASSWORD}
+        )),
+        'token': ((200, ), lambda c, n: c.request(
+            'POST', '/api/token/', {'email': shared(n), 'password': PASSWORD}
+        )),
+        'logout': ((200, ), logout),
+        'forgot_password': ((200, ), lambda c, n: c.request(
+            'POST', '/api/forgot_password/', {'email': shared(n)}
+        )),
+        'set_password': ((200, ), lambda c, n: c.request(
+            'PUT', '/api/set_password/',
+            {'old_password': PASSWORD, 'new_password': PASSWORD},
+            bearer(shared_token(n))
+        )),
+        'create_team': ((201, ), lambda c, n: c.request(
+            'POST', '/api/create_team/', {'name': 'team{}'.format(n)},
+            bearer(fx['teamless_tokens'][n])
+        )),
+        'invite': ((200, ), lambda c, n: c.request(
+            'POST', '/api/invite/', {'email': 'invited{}@loadtest.local'.format(n)},
+            bearer(owner_token(n))
+        )),
+        'confirm': ((200, ), lambda c, n: c.request(
+            'GET', '/api/{}/{}/confirm/'.format(*fx['confirm'][n])
+        )),
+        'forgot_password_accept': ((200, ), lambda c, n: c.request(
+            'GET', '/api/{}/{}/forgot_password_accept/'.format(*fx['forgot'][n])
+        )),
+        'team_list': ((200, ), lambda c, n: c.request(
+            'GET', '/api/teams/', headers=bearer(fx['staff_token'])
+        )),
+        'team_detail': ((200, ), lambda c, n: c.request(
+            'GET', team, headers=bearer(fx['staff_token'])
+        )),
+        'team_members': ((200, ), lambda c, n: c.request(
+            'GET', team + 'members/', headers=bearer(fx['staff_token'])
+        )),
+        'throttle_stats': ((200, ), lambda c, n: c.request(
+            'GET', '/api/throttle_stats/', headers=bearer(fx['staff_token'])
+        )),
+        # every membership of the 1000 member team, as admins download it
+        'export': ((200, ), lambda c, n: c.request(
+            'GET', '/api/export/members.csv',
+            headers=dict(bearer(fx['staff_token']), **{'Accept-Encoding': 'gzip'})
+        )),
+        'metrics': ((200, ), lambda c, n: c.request('GET', '/api/metrics/')),
+    }
+
+
+def percentile(values, q):
+    if not values:
+        return None
+    return values[min(len(values) - 1, int(len(values) * q))]
+
+
+def run_scenario(port, expected, call, requests, clients):
+    def worker(numbers):
+        results = []
+        for n in numbers:
+            # a fresh client per request: no session carried between calls
+            results.append(call(Client(port), n))
+        return results
+
+    started = time.perf_counter()
+    with ThreadPoolExecutor(clients) as pool:
+        chunks = pool.map(worker, [range(i, requests, clients) for i in range(clients)])
+        results = [r for chunk in chunks for r in chunk]
+    wall = time.perf_counter() - started
+
+    latencies = sorted(r.elapsed * 1000 for r in results)
+    errors = sum(1 for r in results if r.status not in expected)
+    return {
+        'requests': len(results),
+        'errors': errors,
+        'error_rate': errors / len(results),
+        'rps': len(results) / wall,
+        'p50_ms': percentile(latencies, 0.50),
+        'p95_ms': percentile(latencies, 0.95),
+        'p99_ms': percentile(latencies, 0.99),
+        'statuses': dict(Counter(str(r.status) for r in results)),
+    }
+
+
+def free_port():
+    sock = socket.socket()
+    sock.bind(('127.0.0.1', 0))
+    port = sock.getsockname()[1]
+    sock.close()
+    return port
+
+
+def wait_for_port(port, timeout=30):
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        try:
+            socket.create_connection(('127.0.0.1', port), 1).close()
+            return
+        except OSError:
+            time.sleep(0.1)
+    raise RuntimeError('gunicorn did not start on port {}'.format(port))
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--clients', type=int, default=8, help='concurrent clients')
+    parser.add_argument('--requests', type=int, default=100, help='requests per endpoint')
+    parser.add_argument('--workers', type=int, default=4, help='gunicorn workers')
+    parser.add_argument('--endpoints', nargs='*', help='only run these endpoints')
+    parser.add_argument('--no-outbox', action='store_true', help='do not run the send_outbox worker')
+    parser.add_argument('--output', help='write JSON results to this file')
+    args = parser.parse_args(argv)
+
+    tmp_dir = tempfile.mkdtemp(prefix='drfik-loadtest-')
+    smtp_port = free_port()
+    env = dict(
+        os.environ,
+        DJANGO_SETTINGS_MODULE='loadtest.settings',
+        LOADTEST_DIR=tmp_dir,
+        LOADTEST_DB=os.path.join(tmp_dir, 'db.sqlite3'),
+        LOADTEST_SMTP_PORT=str(smtp_port),
+        METRICS_DIR=os.path.join(tmp_dir, 'metrics'),
+        PYTHONPATH=BASE_DIR,
+    )
+    os.environ.update(env)
+    os.mkdir(env['METRICS_DIR'])
+
+    sink = SmtpSink(('127.0.0.1', smtp_port), None)
+    threading.Thread(target=asyncore.loop, kwargs={'timeout': 0.1}, daemon=True).start()
+
+    processes = []
+    try:
+        subprocess.check_call(
+            [sys.executable, 'manage.py', 'migrate', '-v', '0'],
+            cwd=BASE_DIR, env=env
+        )
+        fixtures = prepare_fixtures(args.requests, args.clients)
+
+        port = free_port()
+        processes.append(subprocess.Popen(
+            [sys.executable, '-m', 'gunicorn.app.wsgiapp', 'drfik.wsgi',
+             '--workers', str(args.workers), '--bind', '127.0.0.1:{}'.format(port),
+             '--preload', '--log-level', 'warning'],
+            cwd=BASE_DIR, env=env
+        ))
+        if not args.no_outbox:
+            processes.append(subprocess.Popen(
+                [sys.executable, 'manage.py', 'send_outbox', '--loop', '--interval', '0.2'],
+                cwd=BASE_DIR, env=env, stdout=subprocess.DEVNULL
+            ))
+        wait_for_port(port)
+
+        report = {}
+        for name, (expected, call) in scenarios(fixtures).items():
+            if args.endpoints and name not in args.endpoints:
+                continue
+            report[name] = run_scenario(port, expected, call, args.requests, args.clients)
+            print('{:<24} {requests:>6} req {rps:>8.1f} req/s  p50 {p50_ms:>7.1f} ms  '
+                  'p95 {p95_ms:>7.1f} ms  p99 {p99_ms:>7.1f} ms  errors {error_rate:.1%}'
+                  .format(name, **report[name]))
+    finally:
+        for process in processes:
+            process.terminate()
+            process.wait()
+        sink.close()
+        shutil.rmtree(tmp_dir, ignore_errors=True)
+
+    result = {
+        'config': vars(args),
+        'emails_received': sink.received,
+        'endpoints': report,
+    }
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(result, f, indent=2, sort_keys=True)
+    return 1 if any(r['errors'] for r in report.values()) else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,29 @@
+"""
+Settings used by the load-test harness: a throwaway sqlite database, a
+local SMTP sink and no rate limits. Values come from the environment
+prepared by ``loadtest/run.py``.
+"""
+import os
+
+from drfik.settings import *  # noqa
+
+DATABASES = {
+    'default': {
+        'ENGINE': 'drfik.db.sqlite3',
+        'NAME': os.environ['LOADTEST_DB'],
+    },
+    'replica': {
+        'ENGINE': 'drfik.db.sqlite3',
+        'NAME': os.environ['LOADTEST_DB'],
+        'READ_ONLY': True,
+    },
+}
+
+EMAIL_BACKEND = 'django.core.mail.backends.smtp.EmailBackend'
+EMAIL_HOST = '127.0.0.1'
+EMAIL_PORT = int(os.environ.get('LOADTEST_SMTP_PORT', 1025))
+EMAIL_USE_TLS = False
+EMAIL_HOST_USER = ''
+EMAIL_HOST_PASSWORD = ''
+
+THROTTLE = {'RATES': {}}
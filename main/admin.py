@@ -2,5 +2,164 @@
 from __future__ import unicode_literals
 
 from django.contrib import admin
+from django.contrib.auth import get_user_model
+from django.contrib.auth.admin import UserAdmin
+from django.contrib.auth.forms import UserChangeForm
+from django.core.exceptions import ValidationError
+from django.core.paginator import EmptyPage, PageNotAnInteger, Paginator
+from django.db.models import Count, IntegerField, OuterRef, Subquery
+from django.db.models.functions import Coalesce
+from django.forms.models import BaseInlineFormSet
 
-# Register your models here.
+from main.models import Team, UserEmail, normalize_email
+from main.pagination import EstimatedCountPaginator
+
+Membership = Team.members.through
+
+
+class PaginatedInlineFormSet(BaseInlineFormSet):
+    """
+    Shows one page of the related rows, so that a team with a million
+    members renders ``per_page`` forms, not a million.
+    """
+    per_page = 50
+    page = 1
+    page_param = 'page'
+
+    def get_queryset(self):
+        if not hasattr(self, '_queryset'):
+            # the through model has no default ordering: without one the
+            # pages may overlap and skip rows
+            self.paginator = Paginator(
+                super(PaginatedInlineFormSet, self).get_queryset().order_by('pk'),
+                self.per_page
+            )
+            try:
+                self.page_obj = self.paginator.page(self.page)
+            except PageNotAnInteger:
+                self.page_obj = self.paginator.page(1)
+            except EmptyPage:
+                self.page_obj = self.paginator.page(self.paginator.num_pages)
+            self._queryset = self.page_obj.object_list
+        return self._queryset
+
+
+class MembershipFormSet(PaginatedInlineFormSet):
+
+    def clean(self):
+        super(MembershipFormSet, self).clean()
+        rows = [
+            form.instance for form in self.forms
+            if form.has_changed() and form not in self.deleted_forms and
+            form.instance.user_id is not None
+        ]
+        user_ids = [row.user_id for row in rows]
+        # a user belongs to one team at most, see main_team_members_user_id_uniq
+        taken = set(
+            Membership.objects
+            .filter(user_id__in=user_ids)
+            .exclude(pk__in=[row.pk for row in rows if row.pk])
+            .values_list('user_id', flat=True)
+        )
+        if taken or len(set(user_ids)) < len(user_ids):
+            raise ValidationError('A user can only be a member of one team.')
+
+
+class MembershipInline(admin.TabularInline):
+    model = Membership
+    formset = MembershipFormSet
+    template = 'admin/main/membership_inline.html'
+    extra = 1
+
+    def get_formset(self, request, obj=None, **kwargs):
+        formset = super(MembershipInline, self).get_formset(request, obj, **kwargs)
+        formset.page_param = '{}_page'.format(self.fk_name)
+        formset.page = request.GET.get(formset.page_param, 1)
+        return formset
+
+
+class TeamMembersInline(MembershipInline):
+    fk_name = 'team'
+    raw_id_fields = ('user', )
+    verbose_name = 'member'
+    verbose_name_plural = 'members'
+
+
+class UserTeamsInline(MembershipInline):
+    fk_name = 'user'
+    raw_id_fields = ('team', )
+    verbose_name = 'team'
+    verbose_name_plural = 'teams'
+
+
+class MembershipAdminMixin(object):
+    """
+    Memberships saved through the inline formsets bypass m2m_changed, so
+    the team versions kept by main.signals are bumped here.
+    """
+
+    def save_formset(self, request, form, formset, change):
+        super(MembershipAdminMixin, self).save_formset(request, form, formset, change)
+        if formset.model is not Membership:
+            return
+        rows = formset.new_objects + formset.deleted_objects + [
+            obj for obj, _ in formset.changed_objects
+        ]
+        if rows:
+            Team.objects.bump_version(set(row.team_id for row in rows))
+
+
+@admin.register(Team)
+class TeamAdmin(MembershipAdminMixin, admin.ModelAdmin):
+    list_display = ('name', 'member_count', 'version', 'updated_at')
+    search_fields = ('name', )
+    # the default widget for members would list every user
+    exclude = ('members', )
+    readonly_fields = ('version', 'updated_at')
+    inlines = (TeamMembersInline, )
+    paginator = EstimatedCountPaginator
+    show_full_result_count = False
+
+    def get_queryset(self, request):
+        # counted in the page query instead of a query per row, and by a
+        # correlated subquery so that only the teams of the page are
+        # counted, not the whole membership table
+        counts = (
+            Membership.objects
+            .filter(team=OuterRef('pk'))
+            .order_by()
+            .values('team')
+            .annotate(count=Count('*'))
+            .values('count')
+        )
+        return super(TeamAdmin, self).get_queryset(request).annotate(
+            member_count=Coalesce(Subquery(counts, output_field=IntegerField()), 0)
+        )
+
+    def member_count(self, obj):
+        return obj.member_count
+    member_count.admin_order_field = 'member_count'
+
+
+class ScaledUserChangeForm(UserChangeForm):
+
+    def clean_email(self):
+        # main.signals copies the email to main_useremail, whose unique
+        # index ignores case; check it here rather than fail on save
+        email = self.cleaned_data.get('email')
+        if email and UserEmail.objects.filter(
+            email=normalize_email(email)
+        ).exclude(user_id=self.instance.pk).exists():
+            raise ValidationError('A user with that email already exists.')
+        return email
+
+
+class ScaledUserAdmin(MembershipAdminMixin, UserAdmin):
+    form = ScaledUserChangeForm
+    inlines = (UserTeamsInline, )
+    paginator = EstimatedCountPaginator
+    show_full_result_count = False
+
+
+admin.site.unregister(get_user_model())
+admin.site.register(get_user_model(), ScaledUserAdmin)
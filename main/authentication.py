@@ -0,0 +1,77 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.utils.deprecation import CallableFalse, CallableTrue
+from django.utils.functional import LazyObject
+from rest_framework.authentication import (
+    BaseAuthentication,
+    get_authorization_header,
+)
+from rest_framework.exceptions import AuthenticationFailed
+
+from main import usercache
+from main.token import api_token
+
+
+class TokenUser(LazyObject):
+    """
+    Proxy for the user of a valid API token. Only the id is known up front;
+    the user row is loaded on first access to any other attribute, so
+    authentication and permission checks that only need the id stay
+    off the database.
+    """
+    is_anonymous = CallableFalse
+    is_authenticated = CallableTrue
+
+    # memoized per request and kept on the proxy without loading the user
+    local_attrs = ('_teams_cache', )
+
+    def __init__(self, pk):
+        self.__dict__['pk'] = self.__dict__['id'] = pk
+        super(TokenUser, self).__init__()
+
+    def _setup(self):
+        user = usercache.get_user(self.pk)
+        # deleted or deactivated after the token was issued, rejected like
+        # ModelBackend rejects them for sessions
+        if user is None or not user.is_active:
+            raise AuthenticationFailed('User inactive or deleted')
+        self._wrapped = user
+
+    def __getattr__(self, name):
+        if name in self.local_attrs:
+            raise AttributeError(name)
+        return super(TokenUser, self).__getattr__(name)
+
+    def __setattr__(self, name, value):
+        if name in self.local_attrs:
+            self.__dict__[name] = value
+        else:
+            super(TokenUser, self).__setattr__(name, value)
+
+    def __bool__(self):
+        return True
+    __nonzero__ = __bool__
+
+
+class SignedTokenAuthentication(BaseAuthentication):
+    """
+    Authenticates ``Authorization: Bearer <token>`` headers issued by
+    ObtainTokenView.
+    """
+    keyword = 'Bearer'
+
+    def authenticate(self, request):
+        auth = get_authorization_header(request).split()
+        if not auth or auth[0].lower() != self.keyword.lower().encode():
+            return None
+        if len(auth) != 2:
+            raise AuthenticationFailed('Invalid token header')
+
+        user_id = api_token.check_token(auth[1].decode('latin-1'))
+        if user_id is None:
+            raise AuthenticationFailed('Invalid or expired token')
+        return TokenUser(user_id), None
+
+    def authenticate_header(self, request):
+        return self.keyword
@@ -0,0 +1,52 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.contrib.auth import get_user_model
+from django.contrib.auth.backends import ModelBackend
+from django.core.exceptions import PermissionDenied
+from django.db import router
+
+from main import usercache
+from main.models import UserEmail
+
+UserModel = get_user_model()
+
+
+class EmailBackend(ModelBackend):
+    """
+    Authenticates by case-insensitive email through the UserEmail index,
+    falling back to the username for values that are not emails.
+
+    Passwords are checked against the primary, never against
+    ``main.usercache`` or the replica: a password changed in another
+    worker process must stop working at once. The users read here refresh
+    the cache. Sessions are checked against the user of
+    ``usercache.get_session_user``, which is as fresh.
+    """
+
+    def _primary(self):
+        return router.db_for_write(UserModel)
+
+    def authenticate(self, request, username=None, password=None, **kwargs):
+        if username is None or '@' not in username:
+            return super(EmailBackend, self).authenticate(
+                request, username=username, password=password, **kwargs
+            )
+
+        user = UserEmail.objects.get_user(username, using=self._primary())
+        if user is None:
+            # Run the default password hasher once to reduce the timing
+            # difference between an existing and a nonexistent user.
+            UserModel().set_password(password)
+        else:
+            usercache.set_user(user)
+            if user.check_password(password) and self.user_can_authenticate(user):
+                return user
+        # stop here instead of letting ModelBackend hash the password again
+        raise PermissionDenied
+
+    def get_user(self, user_id):
+        # the session hash derives from the password hash, the cached user
+        # is checked against its shared version
+        user = usercache.get_session_user(user_id)
+        return user if user and self.user_can_authenticate(user) else None
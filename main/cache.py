@@ -0,0 +1,166 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+import base64
+from datetime import datetime
+
+from django.conf import settings
+from django.core.cache.backends import db
+from django.core.cache.backends.base import DEFAULT_TIMEOUT
+from django.db import DatabaseError, connections, router, transaction
+from django.utils import six, timezone
+
+try:
+    from django.utils.six.moves import cPickle as pickle
+except ImportError:
+    import pickle
+
+
+class DatabaseCache(db.DatabaseCache):
+    """
+    Django's DatabaseCache, with an add() that does not count the whole
+    table first to cull it, and an ``add_many`` and a ``set_many`` that
+    write a list of keys in a few queries per ``batch_size`` keys. Expired
+    entries are deleted by ``delete_expired``, run by the purge command,
+    instead of culled on writes.
+    """
+    batch_size = 500
+
+    def add(self, key, value, timeout=DEFAULT_TIMEOUT, version=None):
+        return key in self.add_many({key: value}, timeout, version)
+
+    def add_many(self, data, timeout=DEFAULT_TIMEOUT, version=None):
+        """
+        add() of every item of the ``data`` dict. Returns the list of the
+        keys that were added.
+        """
+        keys = dict((self.make_key(key, version=version), key) for key in data)
+        for key in keys:
+            self.validate_key(key)
+        expires = self._expires(self.get_backend_timeout(timeout))
+        added = []
+        made_keys = list(keys)
+        # sqlite allows 999 parameters per query
+        for start in range(0, len(made_keys), self.batch_size):
+            batch = made_keys[start:start + self.batch_size]
+            added.extend(self._add_batch(
+                [(key, data[keys[key]]) for key in batch], expires
+            ))
+        return [keys[key] for key in added]
+
+    def _add_batch(self, items, expires):
+        db_alias = router.db_for_write(self.cache_model_class)
+        connection = connections[db_alias]
+        table = connection.ops.quote_name(self._table)
+        keys = [key for key, _ in items]
+        in_keys = 'cache_key IN ({})'.format(', '.join(['%s'] * len(keys)))
+        now = connection.ops.adapt_datetimefield_value(
+            timezone.now().replace(microsecond=0)
+        )
+        expires = connection.ops.adapt_datetimefield_value(expires)
+
+        with connection.cursor() as cursor:
+            # expired keys are added again, as by DatabaseCache.add()
+            cursor.execute(
+                'DELETE FROM {} WHERE {} AND expires < %s'.format(table, in_keys),
+                keys + [now]
+            )
+            cursor.execute(
+                'SELECT cache_key FROM {} WHERE {}'.format(table, in_keys),
+                keys
+            )
+            existing = set(row[0] for row in cursor.fetchall())
+            rows = [
+                (key, self._encode(value), expires)
+                for key, value in items if key not in existing
+            ]
+            if not rows:
+                return []
+            insert = 'INSERT INTO {} (cache_key, value, expires) VALUES (%s, %s, %s)'.format(table)
+            try:
+                with transaction.atomic(using=db_alias):
+                    cursor.executemany(insert, rows)
+                return [row[0] for row in rows]
+            except DatabaseError:
+                # another process added some of them since the select
+                added = []
+                for row in rows:
+                    try:
+                        with transaction.atomic(using=db_alias):
+                            cursor.execute(insert, row)
+                    except DatabaseError:
+                        continue
+                    added.append(row[0])
+                return added
+
+    def set_many(self, data, timeout=DEFAULT_TIMEOUT, version=None):
+        """
+        set() of every item of the ``data`` dict, in two queries per
+        ``batch_size`` keys.
+        """
+        keys = dict((self.make_key(key, version=version), key) for key in data)
+        for key in keys:
+            self.validate_key(key)
+        expires = self._expires(self.get_backend_timeout(timeout))
+        made_keys = list(keys)
+        for start in range(0, len(made_keys), self.batch_size):
+            rows = [
+                (key, data[keys[key]])
+                for key in made_keys[start:start + self.batch_size]
+            ]
+            if not self._set_batch(rows, expires):
+                # a key was set by another process since the delete
+                for row in rows:
+                    self._set_batch([row], expires)
+
+    def _set_batch(self, items, expires):
+        db_alias = router.db_for_write(self.cache_model_class)
+        connection = connections[db_alias]
+        table = connection.ops.quote_name(self._table)
+        expires = connection.ops.adapt_datetimefield_value(expires)
+        try:
+            with transaction.atomic(using=db_alias), connection.cursor() as cursor:
+                cursor.execute(
+                    'DELETE FROM {} WHERE cache_key IN ({})'.format(
+                        table, ', '.join(['%s'] * len(items))
+                    ),
+                    [key for key, _ in items]
+                )
+                cursor.executemany(
+                    'INSERT INTO {} (cache_key, value, expires) VALUES (%s, %s, %s)'.format(table),
+                    [(key, self._encode(value), expires) for key, value in items]
+                )
+        except DatabaseError:
+            return False
+        return True
+
+    def delete_expired(self):
+        """
+        Deletes the expired entries and returns how many there were.
+        """
+        db_alias = router.db_for_write(self.cache_model_class)
+        connection = connections[db_alias]
+        table = connection.ops.quote_name(self._table)
+        now = connection.ops.adapt_datetimefield_value(
+            timezone.now().replace(microsecond=0)
+        )
+        with connection.cursor() as cursor:
+            cursor.execute('DELETE FROM {} WHERE expires < %s'.format(table), [now])
+            return cursor.rowcount
+
+    def _expires(self, timeout):
+        # as in DatabaseCache._base_set()
+        if timeout is None:
+            expires = datetime.max
+        elif settings.USE_TZ:
+            expires = datetime.utcfromtimestamp(timeout)
+        else:
+            expires = datetime.fromtimestamp(timeout)
+        return expires.replace(microsecond=0)
+
+    def _encode(self, value):
+        encoded = base64.b64encode(pickle.dumps(value, pickle.HIGHEST_PROTOCOL))
+        # the column expects a string, see DatabaseCache._base_set()
+        if six.PY3:
+            encoded = encoded.decode('latin1')
+        return encoded
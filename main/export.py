@@ -0,0 +1,114 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+import csv
+import io
+import zlib
+
+from django.core.serializers.json import DjangoJSONEncoder
+from django.db.models import Count
+
+from main.models import Team
+
+FORMATS = ('ndjson', 'csv')
+
+CONTENT_TYPES = {
+    'ndjson': 'application/x-ndjson',
+    'csv': 'text/csv; charset=utf-8',
+}
+
+
+def keyset(queryset, fields, batch_size):
+    """
+    Yields ``fields`` of every row of ``queryset`` in primary key order,
+    reading ``batch_size`` rows per query from where the previous batch
+    stopped. Only one batch is held in memory, and later batches cost
+    the same as the first one, unlike OFFSET.
+    """
+    last_pk = None
+    while True:
+        batch = queryset.order_by('pk')
+        if last_pk is not None:
+            batch = batch.filter(pk__gt=last_pk)
+        count = 0
+        for row in batch.values_list('pk', *fields)[:batch_size].iterator():
+            count += 1
+            last_pk = row[0]
+            yield row[1:]
+        if count < batch_size:
+            return
+
+
+def team_rows(batch_size):
+    columns = ('id', 'name', 'member_count', 'updated_at')
+    # the count of one batch of teams is a single grouped query
+    queryset = Team.objects.annotate(member_count=Count('members'))
+    return columns, keyset(queryset, columns, batch_size)
+
+
+def member_rows(batch_size):
+    columns = ('team_id', 'team_name', 'user_id', 'email', 'first_name', 'last_name')
+    queryset = Team.members.through.objects.all()
+    return columns, keyset(queryset, (
+        'team_id', 'team__name', 'user_id', 'user__email',
+        'user__first_name', 'user__last_name'
+    ), batch_size)
+
+
+EXPORTS = {
+    'teams': team_rows,
+    'members': member_rows,
+}
+
+
+def encode(columns, rows, fmt, batch_size):
+    """
+    Yields the rows as UTF-8 NDJSON or CSV, ``batch_size`` rows per chunk.
+    """
+    buf = io.StringIO()
+    if fmt == 'csv':
+        writer = csv.writer(buf)
+        writer.writerow(columns)
+        write = writer.writerow
+    else:
+        encoder = DjangoJSONEncoder(ensure_ascii=False)
+
+        def write(row):
+            buf.write(encoder.encode(dict(zip(columns, row))))
+            buf.write('\n')
+
+    count = 0
+    for row in rows:
+        write(row)
+        count += 1
+        if count % batch_size == 0:
+            yield buf.getvalue().encode('utf-8')
+            buf.seek(0)
+            buf.truncate()
+    if buf.tell():
+        yield buf.getvalue().encode('utf-8')
+
+
+def gzip(chunks, level=6):
+    """
+    Compresses a stream of bytes to a gzip file, chunk by chunk.
+    """
+    # wbits 16 + 15 writes the gzip header and trailer
+    compressor = zlib.compressobj(level, zlib.DEFLATED, 16 + zlib.MAX_WBITS)
+    for chunk in chunks:
+        data = compressor.compress(chunk)
+        if data:
+            yield data
+    yield compressor.flush()
+
+
+def export(kind, fmt='ndjson', compress=False, batch_size=1000):
+    """
+    Returns the ``kind`` export, teams or members, as an iterator of
+    bytes. Memory use depends on ``batch_size`` only.
+    """
+    columns, rows = EXPORTS[kind](batch_size)
+    chunks = encode(columns, rows, fmt, batch_size)
+    if compress:
+        chunks = gzip(chunks)
+    return chunks
@@ -0,0 +1,19 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.contrib.auth import hashers
+
+from main.metrics import password_hash_duration
+
+
+class PBKDF2PasswordHasher(hashers.PBKDF2PasswordHasher):
+    """
+    Django's default hasher, timing every PBKDF2 run. ``verify`` and
+    ``harden_runtime`` go through ``encode`` and are timed as well.
+    """
+
+    def encode(self, password, salt, iterations=None):
+        with password_hash_duration.time(algorithm=self.algorithm):
+            return super(PBKDF2PasswordHasher, self).encode(
+                password, salt, iterations
+            )
@@ -0,0 +1,227 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+import functools
+import hashlib
+import json
+import time
+import uuid
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import IntegrityError, router, transaction
+from django.utils import timezone
+from django.utils.crypto import salted_hmac
+from rest_framework import status
+from rest_framework.response import Response
+from rest_framework.utils.encoders import JSONEncoder
+
+from main.models import IdempotencyKey
+
+MAX_KEY_LENGTH = 255
+POLL_INTERVAL = 0.05
+
+
+class KeyInProgress(Exception):
+    pass
+
+
+class KeyReused(Exception):
+    pass
+
+
+def get_config():
+    config = {
+        'TIMEOUT': 24 * 60 * 60,
+        'LOCK_TIMEOUT': 60,
+        'WAIT': 10,
+    }
+    config.update(getattr(settings, 'IDEMPOTENCY', {}))
+    return config
+
+
+def fingerprint(request):
+    """
+    HMAC of what the request asks for, so that a key sent again with
+    another body is refused instead of answered with the wrong response.
+    Keyed with SECRET_KEY: the body may hold a password, and a plain hash
+    of it could be tested against guesses.
+    """
+    data = request.data
+    if hasattr(data, 'lists'):
+        data = dict(data.lists())
+    payload = json.dumps(
+        [request.method, request.get_full_path(), data],
+        sort_keys=True,
+        default=str
+    )
+    return salted_hmac('main.idempotency.fingerprint', payload).hexdigest()
+
+
+def run_once(key, fingerprint, func):
+    """
+    Runs ``func`` once per ``key`` and returns ``(result, replayed)``.
+
+    ``func`` returns ``(result, record)``; the record is stored for
+    ``TIMEOUT`` seconds unless it is None, and returned with ``replayed``
+    set to every later call with the key. Calls made while another one
+    holds the key wait up to ``WAIT`` seconds for its record, then raise
+    ``KeyInProgress``. ``KeyReused`` is raised when the key was taken for
+    another fingerprint.
+
+    The key is a row of ``IdempotencyKey`` on the primary: a first call
+    looks it up, inserts it and stores the record, a replay only looks
+    it up.
+    """
+    config = get_config()
+    keys = IdempotencyKey.objects.using(router.db_for_write(IdempotencyKey))
+    token = uuid.uuid4().hex
+    deadline = time.time() + config['WAIT']
+
+    while True:
+        row = keys.filter(key=key).values_list(
+            'fingerprint', 'record', 'expires_at'
+        ).first()
+        now = timezone.now()
+        lock_expires_at = now + timedelta(seconds=config['LOCK_TIMEOUT'])
+        if row is None:
+            try:
+                with transaction.atomic(using=keys.db):
+                    keys.create(
+                        key=key,
+                        fingerprint=fingerprint,
+                        token=token,
+                        expires_at=lock_expires_at
+                    )
+                break
+            except IntegrityError:
+                # another call inserted it since the lookup
+                continue
+        stored_fingerprint, record, expires_at = row
+        if expires_at <= now:
+            # an old record, or a holder that died: take the key over,
+            # unless another call did since the lookup
+            if keys.filter(key=key, expires_at=expires_at).update(
+                fingerprint=fingerprint,
+                token=token,
+                record=None,
+                expires_at=lock_expires_at
+            ):
+                break
+            continue
+        if stored_fingerprint != fingerprint:
+            raise KeyReused
+        if record is not None:
+            return json.loads(record), True
+        if time.time() >= deadline:
+            raise KeyInProgress
+        time.sleep(POLL_INTERVAL)
+
+    # filtered on the token, unless the lock expired and another call
+    # took the key meanwhile
+    held = keys.filter(key=key, token=token)
+    try:
+        result, record = func()
+    except Exception:
+        held.delete()
+        raise
+    if record is None:
+        held.delete()
+    else:
+        held.update(
+            record=json.dumps(record, cls=JSONEncoder),
+            expires_at=timezone.now() + timedelta(seconds=config['TIMEOUT'])
+        )
+    return result, False
+
+
+class IdempotencyMixin(object):
+    """
+    POSTs sent with an ``Idempotency-Key`` header run once per key, user
+    and view. Retries get the stored response, marked with an
+    ``Idempotent-Replayed`` header, without running the view again, and
+    concurrent duplicates wait for the first one to finish.
+
+    Permissions and throttles are checked when the view runs, not when a
+    response is replayed: a retried create_team must get its team back,
+    not a 403 because the user has a team now.
+
+    Only completed responses below 500 are stored: a request that failed
+    with an exception runs again when retried.
+    """
+    replayed_headers = ('Location', )
+    idempotency_key = None
+    # on top of the query_budget of the view: the lookup of the key, its
+    # insert in a savepoint and the update storing the response
+    idempotency_query_budget = 5
+
+    def get_idempotency_key(self, key):
+        return 'idempotency:{}:{}:{}'.format(
+            type(self).__name__,
+            self.request.user.pk or '',
+            hashlib.sha256(key.encode('utf-8')).hexdigest()
+        )
+
+    def initial(self, request, *args, **kwargs):
+        if request.method == 'POST':
+            self.idempotency_key = request.META.get('HTTP_IDEMPOTENCY_KEY')
+        super(IdempotencyMixin, self).initial(request, *args, **kwargs)
+        if self.idempotency_key:
+            # dispatch() looks the handler up after initial(), so this
+            # wraps the post() of the view whatever class defines it
+            self.post = functools.partial(self.idempotent_post, self.post)
+
+    def check_permissions(self, request):
+        if not self.idempotency_key:
+            super(IdempotencyMixin, self).check_permissions(request)
+
+    def check_throttles(self, request):
+        if not self.idempotency_key:
+            super(IdempotencyMixin, self).check_throttles(request)
+
+    def idempotent_post(self, handler, request, *args, **kwargs):
+        key = self.idempotency_key
+        if len(key) > MAX_KEY_LENGTH:
+            return Response(
+                {'error': 'Idempotency-Key is longer than {} characters'.format(MAX_KEY_LENGTH)},
+                status=status.HTTP_400_BAD_REQUEST
+            )
+
+        def run():
+            self.idempotency_key = None
+            self.check_permissions(request)
+            self.check_throttles(request)
+            response = handler(request, *args, **kwargs)
+            if response.status_code >= 500 or not hasattr(response, 'data'):
+                return response, None
+            return response, {
+                'status': response.status_code,
+                'data': response.data,
+                'headers': dict(
+                    (name, response[name])
+                    for name in self.replayed_headers if response.has_header(name)
+                ),
+            }
+
+        try:
+            result, replayed = run_once(
+                self.get_idempotency_key(key), fingerprint(request), run
+            )
+        except KeyInProgress:
+            return Response(
+                {'error': 'A request with this Idempotency-Key is in progress'},
+                status=status.HTTP_409_CONFLICT
+            )
+        except KeyReused:
+            return Response(
+                {'error': 'Idempotency-Key was used for another request'},
+                status=status.HTTP_422_UNPROCESSABLE_ENTITY
+            )
+        if not replayed:
+            return result
+
+        response = Response(
+            result['data'], status=result['status'], headers=result['headers']
+        )
+        response['Idempotent-Replayed'] = 'true'
+        return response
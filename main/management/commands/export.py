@@ -0,0 +1,65 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+import sys
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+
+from main.export import EXPORTS, FORMATS, export
+
+
+class Command(BaseCommand):
+    help = 'Stream every team, or every team membership, as NDJSON or CSV'
+
+    def add_arguments(self, parser):
+        parser.add_argument('kind', choices=sorted(EXPORTS))
+        parser.add_argument(
+            '--format',
+            choices=FORMATS,
+            default='ndjson',
+            help='Output format'
+        )
+        parser.add_argument(
+            '--gzip',
+            action='store_true',
+            help='Compress the output with gzip'
+        )
+        parser.add_argument(
+            '--output',
+            default=None,
+            help='File to write, stdout by default'
+        )
+        parser.add_argument(
+            '--batch-size',
+            type=int,
+            default=1000,
+            help='Rows read per query'
+        )
+
+    def handle(self, *args, **options):
+        if options['batch_size'] < 1:
+            raise CommandError('--batch-size must be positive')
+
+        started = time.time()
+        size = 0
+        chunks = export(
+            options['kind'],
+            options['format'],
+            options['gzip'],
+            options['batch_size']
+        )
+        if options['output']:
+            out = open(options['output'], 'wb')
+        else:
+            out = getattr(sys.stdout, 'buffer', sys.stdout)
+        try:
+            for chunk in chunks:
+                out.write(chunk)
+                size += len(chunk)
+        finally:
+            if options['output']:
+                out.close()
+        self.stderr.write('Wrote {} bytes in {:.2f}s'.format(
+            size, time.time() - started
+        ))
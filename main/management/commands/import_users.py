@@ -0,0 +1,207 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+import csv
+import io
+import json
+import time
+from itertools import islice
+from multiprocessing import Pool
+
+from django.contrib.auth import get_user_model
+from django.contrib.auth.hashers import (
+    UNUSABLE_PASSWORD_PREFIX,
+    identify_hasher,
+    make_password,
+)
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+from django.utils import timezone
+
+from main import usercache
+from main.models import Team, UserEmail, normalize_email
+
+
+def read_rows(path, fmt):
+    with io.open(path, encoding='utf-8', newline='') as f:
+        if fmt == 'csv':
+            for row in csv.DictReader(f):
+                yield row
+        else:
+            for line in f:
+                line = line.strip()
+                if line:
+                    yield json.loads(line)
+
+
+def parse_bool(value, default):
+    """
+    Parses a boolean column, ``default`` when the value is missing or
+    empty, as CSV files write it.
+    """
+    if isinstance(value, bool):
+        return value
+    value = '' if value is None else str(value).strip().lower()
+    if not value:
+        return default
+    return value not in ('0', 'false', 'no')
+
+
+def hash_row(row):
+    """
+    Replace the plain text password of a row with its hash. Runs in the
+    worker processes of the pool.
+    """
+    row = dict(row)
+    password = row.pop('password', None)
+    if not row.get('password_hash'):
+        row['password_hash'] = make_password(password or None)
+    return row
+
+
+class Command(BaseCommand):
+    help = 'Import users and team memberships from a NDJSON or CSV file'
+
+    def add_arguments(self, parser):
+        parser.add_argument('path')
+        parser.add_argument(
+            '--format',
+            choices=('ndjson', 'csv'),
+            default=None,
+            help='Input format, guessed from the file extension by default'
+        )
+        parser.add_argument(
+            '--chunk-size',
+            type=int,
+            default=500,
+            help='Rows inserted per transaction'
+        )
+        parser.add_argument(
+            '--workers',
+            type=int,
+            default=None,
+            help='Processes used to hash plain text passwords'
+        )
+
+    def handle(self, *args, **options):
+        path = options['path']
+        fmt = options['format'] or ('csv' if path.endswith('.csv') else 'ndjson')
+        chunk_size = options['chunk_size']
+        if chunk_size < 1:
+            raise CommandError('--chunk-size must be positive')
+
+        self.imported = self.skipped = 0
+        started = time.time()
+        rows = read_rows(path, fmt)
+        pool = Pool(options['workers'])
+        try:
+            while True:
+                chunk = list(islice(rows, chunk_size))
+                if not chunk:
+                    break
+                chunk = pool.map(hash_row, chunk)
+                self.import_chunk(chunk)
+                self.report(started)
+        finally:
+            pool.close()
+            pool.join()
+
+        self.stdout.write('Done: ', ending='')
+        self.report(started)
+
+    def report(self, started):
+        elapsed = time.time() - started
+        self.stdout.write(
+            '{} imported, {} skipped, {:.0f} rows/s'.format(
+                self.imported,
+                self.skipped,
+                (self.imported + self.skipped) / elapsed if elapsed else 0
+            )
+        )
+
+    def clean_chunk(self, chunk):
+        User = get_user_model()
+        rows = {}
+        for row in chunk:
+            email = (row.get('email') or '').strip()
+            if not row['password_hash'].startswith(UNUSABLE_PASSWORD_PREFIX):
+                try:
+                    identify_hasher(row['password_hash'])
+                except ValueError:
+                    email = None
+            if not email or normalize_email(email) in rows:
+                self.skipped += 1
+                continue
+            row['email'] = email
+            rows[normalize_email(email)] = row
+
+        existing = UserEmail.objects.existing(rows)
+        existing.update(
+            normalize_email(username) for username in
+            User.objects
+            .filter(username__in=[row['email'] for row in rows.values()])
+            .values_list('username', flat=True)
+        )
+        for normalized in existing:
+            if rows.pop(normalized, None):
+                self.skipped += 1
+        return rows
+
+    def get_teams(self, names):
+        teams = dict(
+            Team.objects.filter(name__in=names).values_list('name', 'pk')
+        )
+        missing = [name for name in names if name not in teams]
+        if missing:
+            Team.objects.bulk_create(Team(name=name) for name in missing)
+            teams.update(
+                Team.objects.filter(name__in=missing).values_list('name', 'pk')
+            )
+        return teams
+
+    @transaction.atomic
+    def import_chunk(self, chunk):
+        User = get_user_model()
+        rows = self.clean_chunk(chunk)
+        if not rows:
+            return
+
+        now = timezone.now()
+        User.objects.bulk_create(
+            User(
+                username=row['email'],
+                email=row['email'],
+                password=row['password_hash'],
+                first_name=row.get('first_name') or '',
+                last_name=row.get('last_name') or '',
+                is_active=parse_bool(row.get('is_active'), True),
+                date_joined=now,
+            )
+            for row in rows.values()
+        )
+        user_ids = dict(
+            (normalize_email(username), pk) for username, pk in
+            User.objects
+            .filter(username__in=[row['email'] for row in rows.values()])
+            .values_list('username', 'pk')
+        )
+        # bulk_create skips the post_save signals that maintain UserEmail
+        # and the user cache
+        UserEmail.objects.bulk_create(
+            UserEmail(user_id=pk, email=email)
+            for email, pk in user_ids.items()
+        )
+        usercache.invalidate_many(user_ids.values())
+
+        team_names = set(row['team'] for row in rows.values() if row.get('team'))
+        if team_names:
+            teams = self.get_teams(team_names)
+            Team.members.through.objects.bulk_create(
+                Team.members.through(
+                    team_id=teams[row['team']],
+                    user_id=user_ids[email]
+                )
+                for email, row in rows.items() if row.get('team')
+            )
+            Team.objects.bump_version(teams.values())
+        self.imported += len(rows)
@@ -0,0 +1,85 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+
+from main.purge import (
+    purge_expired_cache_entries,
+    purge_expired_idempotency_keys,
+    purge_expired_sessions,
+    purge_unconfirmed_users,
+)
+
+TARGETS = (
+    ('users', purge_unconfirmed_users),
+    ('sessions', purge_expired_sessions),
+    ('idempotency_keys', purge_expired_idempotency_keys),
+    ('cache', purge_expired_cache_entries),
+)
+
+
+class Command(BaseCommand):
+    help = (
+        'Delete users who never confirmed their email before the link '
+        'expired, and expired sessions, idempotency keys and cache entries'
+    )
+
+    def add_arguments(self, parser):
+        # no choices=: argparse checks the empty default against them
+        parser.add_argument(
+            'targets',
+            nargs='*',
+            help='What to purge: {}, everything by default'.format(
+                ', '.join(name for name, _ in TARGETS)
+            )
+        )
+        parser.add_argument(
+            '--chunk-size',
+            type=int,
+            default=500,
+            help='Rows deleted per transaction'
+        )
+        parser.add_argument(
+            '--pause',
+            type=float,
+            default=0.05,
+            help='Seconds to sleep between chunks, leaving the database to live requests'
+        )
+        parser.add_argument(
+            '--loop',
+            action='store_true',
+            help='Keep purging instead of exiting when nothing is left'
+        )
+        parser.add_argument(
+            '--interval',
+            type=float,
+            default=60.0,
+            help='Seconds to sleep between runs with --loop'
+        )
+
+    def handle(self, *args, **options):
+        if options['chunk_size'] < 1:
+            raise CommandError('--chunk-size must be positive')
+        names = [name for name, _ in TARGETS]
+        unknown = [name for name in options['targets'] if name not in names]
+        if unknown:
+            raise CommandError('Unknown targets {}, choose from {}'.format(
+                ', '.join(unknown), ', '.join(names)
+            ))
+        targets = [
+            (name, func) for name, func in TARGETS
+            if not options['targets'] or name in options['targets']
+        ]
+        while True:
+            for name, func in targets:
+                result = func(options['chunk_size'], options['pause'])
+                self.stdout.write(
+                    'Deleted {} {} in {} chunks, {:.2f}s'.format(
+                        result.deleted, name, result.chunks, result.seconds
+                    )
+                )
+            if not options['loop']:
+                break
+            time.sleep(options['interval'])
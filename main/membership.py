@@ -0,0 +1,23 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+
+def get_teams(user):
+    """
+    Returns the ``(id, name)`` pairs of the user's teams.
+
+    The result is memoized on the user object for the rest of the request,
+    so that the permission check and the view share one query. It is not
+    kept between requests: a process-local cache would go on granting
+    access in the other worker processes after a membership change.
+    """
+    if user.pk is None:
+        return []
+    try:
+        return user._teams_cache
+    except AttributeError:
+        pass
+
+    teams = list(user.teams.order_by('pk').values_list('pk', 'name'))
+    user._teams_cache = teams
+    return teams
@@ -0,0 +1,254 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+import atexit
+import glob
+import json
+import os
+import threading
+import time
+import uuid
+from bisect import bisect_left
+from collections import OrderedDict
+from contextlib import contextmanager
+
+from django.conf import settings
+from django.utils import six
+
+BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+REGISTRY = OrderedDict()
+
+_lock = threading.Lock()
+_state = {'pid': None, 'flushed_at': 0, 'path': None}
+
+
+class Histogram(object):
+    """
+    Latency histogram with Prometheus buckets. Samples are kept per
+    process and written to ``METRICS_DIR`` by ``flush()``, so that the
+    metrics endpoint can add up every gunicorn worker.
+    """
+    type = 'histogram'
+
+    def __init__(self, name, documentation, labelnames=(), buckets=BUCKETS):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self.buckets = tuple(buckets)
+        self.samples = {}
+        REGISTRY[name] = self
+
+    def observe(self, value, **labels):
+        key = tuple(six.text_type(labels[name]) for name in self.labelnames)
+        with _lock:
+            _check_pid()
+            sample = self.samples.get(key)
+            if sample is None:
+                # one counter per bucket plus +Inf, then the sum
+                sample = self.samples[key] = [0] * (len(self.buckets) + 1) + [0.0]
+            sample[bisect_left(self.buckets, value)] += 1
+            sample[-1] += value
+
+    @contextmanager
+    def time(self, **labels):
+        started = time.time()
+        try:
+            yield
+        finally:
+            self.observe(time.time() - started, **labels)
+
+
+class Counter(object):
+    """
+    Prometheus counter, kept per process and added up like ``Histogram``.
+    """
+    type = 'counter'
+
+    def __init__(self, name, documentation, labelnames=()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self.samples = {}
+        REGISTRY[name] = self
+
+    def inc(self, amount=1, **labels):
+        key = tuple(six.text_type(labels[name]) for name in self.labelnames)
+        with _lock:
+            _check_pid()
+            self.samples.setdefault(key, [0])[0] += amount
+
+
+request_duration = Histogram(
+    'http_request_duration_seconds',
+    'Time spent handling a request, by URL name',
+    ('view', 'method')
+)
+db_duration = Histogram(
+    'db_request_duration_seconds',
+    'Time spent in database queries per request, by URL name',
+    ('view', )
+)
+password_hash_duration = Histogram(
+    'password_hash_duration_seconds',
+    'Time spent hashing a password, including verification',
+    ('algorithm', )
+)
+session_duration = Histogram(
+    'session_duration_seconds',
+    'Time spent loading and saving sessions',
+    ('operation', )
+)
+email_render_duration = Histogram(
+    'email_render_duration_seconds',
+    'Time spent rendering an email template',
+    ('template', )
+)
+email_send_duration = Histogram(
+    'email_send_duration_seconds',
+    'Time spent sending an email over SMTP',
+    ('status', )
+)
+throttle_requests = Counter(
+    'throttle_requests_total',
+    'Requests checked against a rate limit, by scope and result',
+    ('scope', 'result')
+)
+
+
+def _check_pid():
+    # samples inherited from a parent process are its own, not ours
+    pid = os.getpid()
+    if _state['pid'] != pid:
+        _state.update(pid=pid, flushed_at=0, path=None)
+        for histogram in REGISTRY.values():
+            histogram.samples = {}
+
+
+def _dump():
+    return dict(
+        (histogram.name, [
+            [list(key), sample] for key, sample in histogram.samples.items()
+        ])
+        for histogram in REGISTRY.values()
+    )
+
+
+def flush(force=False):
+    """
+    Write the samples of this process to its file in ``METRICS_DIR``, at
+    most once per ``METRICS_FLUSH_INTERVAL`` seconds unless ``force``.
+    """
+    directory = getattr(settings, 'METRICS_DIR', None)
+    if not directory:
+        return
+    interval = getattr(settings, 'METRICS_FLUSH_INTERVAL', 1)
+    with _lock:
+        _check_pid()
+        now = time.time()
+        if not force and now - _state['flushed_at'] < interval:
+            return
+        _state['flushed_at'] = now
+        if not _state['path'] or os.path.dirname(_state['path']) != directory:
+            if not any(h.samples for h in REGISTRY.values()):
+                # management commands that time nothing leave no file
+                return
+            if not os.path.isdir(directory):
+                try:
+                    os.makedirs(directory)
+                except OSError:
+                    # created by another worker in the meantime
+                    if not os.path.isdir(directory):
+                        raise
+            # a new file per process: pids are reused after worker restarts
+            _state['path'] = os.path.join(
+                directory, '{}-{}.json'.format(_state['pid'], uuid.uuid4().hex)
+            )
+        tmp_path = _state['path'] + '.tmp'
+        with open(tmp_path, 'w') as f:
+            json.dump(_dump(), f)
+        os.rename(tmp_path, _state['path'])
+
+
+@atexit.register
+def _flush_at_exit():
+    try:
+        flush(force=True)
+    except (IOError, OSError):
+        # METRICS_DIR is gone, nobody is left to read the file
+        pass
+
+
+def collect():
+    """
+    Returns the samples of every process as ``{name: {labels: sample}}``.
+    """
+    directory = getattr(settings, 'METRICS_DIR', None)
+    if not directory:
+        with _lock:
+            _check_pid()
+            dumps = [_dump()]
+    else:
+        flush(force=True)
+        dumps = []
+        for path in glob.glob(os.path.join(directory, '*.json')):
+            try:
+                with open(path) as f:
+                    dumps.append(json.load(f))
+            except (IOError, ValueError):
+                # removed or being replaced while we read it
+                continue
+
+    totals = dict((name, {}) for name in REGISTRY)
+    for dump in dumps:
+        for name, samples in dump.items():
+            if name not in totals:
+                continue
+            for key, sample in samples:
+                total = totals[name].setdefault(tuple(key), [0] * len(sample))
+                for i, value in enumerate(sample):
+                    total[i] += value
+    return totals
+
+
+def _format_labels(pairs):
+    if not pairs:
+        return ''
+    return '{' + ','.join(
+        '{}="{}"'.format(
+            name,
+            value.replace('\\', r'\\').replace('"', r'\"').replace('\n', r'\n')
+        )
+        for name, value in pairs
+    ) + '}'
+
+
+def exposition():
+    """
+    Renders every metric in the Prometheus text exposition format.
+    """
+    lines = []
+    for name, samples in sorted(collect().items()):
+        histogram = REGISTRY[name]
+        lines.append('# HELP {} {}'.format(name, histogram.documentation))
+        lines.append('# TYPE {} {}'.format(name, histogram.type))
+        for key, sample in sorted(samples.items()):
+            labels = list(zip(histogram.labelnames, key))
+            if histogram.type == 'counter':
+                lines.append('{}{} {}'.format(name, _format_labels(labels), sample[0]))
+                continue
+            cumulative = 0
+            for bound, count in zip(histogram.buckets + ('+Inf', ), sample):
+                cumulative += count
+                lines.append('{}_bucket{} {}'.format(
+                    name,
+                    _format_labels(labels + [('le', str(bound))]),
+                    cumulative
+                ))
+            lines.append('{}_sum{} {}'.format(
+                name, _format_labels(labels), repr(float(sample[-1]))
+            ))
+            lines.append('{}_count{} {}'.format(
+                name, _format_labels(labels), cumulative
+            ))
+    return '\n'.join(lines) + '\n'
@@ -0,0 +1,203 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+import logging
+import os
+import random
+import threading
+import time
+
+from django.conf import settings
+from django.core.exceptions import MiddlewareNotUsed
+from django.db import connections
+from django.utils.crypto import constant_time_compare
+
+from main import metrics
+from main.profiling import StackSampler, profile_path
+
+logger = logging.getLogger(__name__)
+
+
+class MetricsMiddleware(object):
+    """
+    Records the latency and database time of every request by URL name.
+    Goes above QueryCountMiddleware, which measures the database time.
+    """
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        started = time.time()
+        response = self.get_response(request)
+        match = getattr(request, 'resolver_match', None)
+        view = match.view_name if match else '<unresolved>'
+        metrics.request_duration.observe(
+            time.time() - started, view=view, method=request.method
+        )
+        if hasattr(request, 'db_time'):
+            metrics.db_duration.observe(request.db_time, view=view)
+        metrics.flush()
+        return response
+
+
+class QueryCounter(object):
+    """
+    Counts and times the queries of the cursors it wraps.
+    """
+
+    def __init__(self):
+        self.count = 0
+        self.duration = 0.0
+
+    def wrap(self, make_cursor):
+        return lambda cursor: CountingCursor(make_cursor(cursor), self)
+
+    def run(self, method, *args):
+        started = time.time()
+        try:
+            return method(*args)
+        finally:
+            self.count += 1
+            self.duration += time.time() - started
+
+
+class CountingCursor(object):
+    """
+    A cursor counting its queries in a ``QueryCounter``. Unlike Django's
+    CursorDebugWrapper it neither formats the SQL, which costs sqlite a
+    ``SELECT QUOTE()`` per parameter, nor logs it with the parameters.
+    """
+
+    def __init__(self, cursor, counter):
+        self.cursor = cursor
+        self.counter = counter
+
+    def __getattr__(self, attr):
+        return getattr(self.cursor, attr)
+
+    def __iter__(self):
+        return iter(self.cursor)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, type, value, traceback):
+        return self.cursor.__exit__(type, value, traceback)
+
+    def callproc(self, *args):
+        return self.counter.run(self.cursor.callproc, *args)
+
+    def execute(self, *args):
+        return self.counter.run(self.cursor.execute, *args)
+
+    def executemany(self, *args):
+        return self.counter.run(self.cursor.executemany, *args)
+
+
+class QueryCountMiddleware(object):
+    """
+    Counts the queries and database time of every request and reports
+    them in the ``X-DB-Queries`` and ``X-DB-Time`` (milliseconds) headers.
+
+    The cursors of every connection are wrapped in a ``CountingCursor``
+    for the time of the request, as Django 2.0's execute_wrapper would.
+
+    Views declare the most queries they may run in a ``query_budget``
+    attribute. Requests going over it are logged as warnings, and
+    main/tests.py asserts the budget of every endpoint.
+    """
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        counter = QueryCounter()
+        wrapped = list(connections.all())
+        for connection in wrapped:
+            # the debug cursor is still used when DEBUG or a test asks
+            # for it, and counted as well
+            connection.make_cursor = counter.wrap(connection.make_cursor)
+            connection.make_debug_cursor = counter.wrap(connection.make_debug_cursor)
+
+        try:
+            response = self.get_response(request)
+        finally:
+            for connection in wrapped:
+                del connection.make_cursor
+                del connection.make_debug_cursor
+
+        request.db_queries = counter.count
+        request.db_time = counter.duration
+        response['X-DB-Queries'] = str(counter.count)
+        response['X-DB-Time'] = '{:.1f}'.format(counter.duration * 1000)
+
+        budget = get_query_budget(request)
+        if budget is not None and counter.count > budget:
+            logger.warning(
+                '%s ran %s queries, over its budget of %s',
+                request.path, counter.count, budget
+            )
+        return response
+
+
+def get_query_budget(request):
+    """
+    The ``query_budget`` of the view, plus its ``idempotency_query_budget``
+    for POSTs sent with an ``Idempotency-Key``.
+    """
+    match = getattr(request, 'resolver_match', None)
+    view_class = getattr(match and match.func, 'view_class', None)
+    budget = getattr(view_class, 'query_budget', None)
+    if (
+        budget is not None and request.method == 'POST' and
+        request.META.get('HTTP_IDEMPOTENCY_KEY')
+    ):
+        budget += getattr(view_class, 'idempotency_query_budget', 0)
+    return budget
+
+
+class ProfilerMiddleware(object):
+    """
+    Samples the stack of a fraction ``PROFILE_SAMPLE_RATE`` of requests,
+    and of requests sending ``X-Profile: <PROFILE_TOKEN>``, and writes
+    them as folded stacks to ``PROFILE_DIR``. Removed from the middleware
+    chain when neither is configured.
+    """
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        self.sample_rate = getattr(settings, 'PROFILE_SAMPLE_RATE', 0)
+        self.token = getattr(settings, 'PROFILE_TOKEN', None)
+        if not self.sample_rate and not self.token:
+            raise MiddlewareNotUsed
+        self.interval = getattr(settings, 'PROFILE_INTERVAL', 0.001)
+        self.directory = settings.PROFILE_DIR
+
+    def should_profile(self, request):
+        header = request.META.get('HTTP_X_PROFILE')
+        if header and self.token:
+            return constant_time_compare(header, self.token)
+        return random.random() < self.sample_rate
+
+    def __call__(self, request):
+        if not self.should_profile(request):
+            return self.get_response(request)
+
+        sampler = StackSampler(
+            threading.current_thread().ident, self.interval
+        ).start()
+        try:
+            response = self.get_response(request)
+        finally:
+            sampler.stop()
+
+        match = getattr(request, 'resolver_match', None)
+        path = profile_path(
+            self.directory, match.view_name if match else 'unresolved'
+        )
+        if not os.path.isdir(self.directory):
+            os.makedirs(self.directory)
+        sampler.write(path)
+        response['X-Profile'] = os.path.basename(path)
+        return response
@@ -0,0 +1,55 @@
+# -*- coding: utf-8 -*-
+# Generated by Django 1.11.8 on 2026-10-18 08:43
+from __future__ import unicode_literals
+
+from django.conf import settings
+from django.db import migrations, transaction
+
+CHUNK_SIZE = 500
+
+
+def backfill(apps, schema_editor):
+    User = apps.get_model(settings.AUTH_USER_MODEL)
+    UserEmail = apps.get_model('main', 'UserEmail')
+    db = schema_editor.connection.alias
+
+    last_pk = 0
+    while True:
+        users = list(
+            User.objects.using(db)
+            .filter(pk__gt=last_pk)
+            .order_by('pk')
+            .values_list('pk', 'email')[:CHUNK_SIZE]
+        )
+        if not users:
+            break
+        last_pk = users[-1][0]
+
+        emails = {}
+        for pk, email in users:
+            email = (email or '').strip().lower()
+            if email and email not in emails:
+                emails[email] = pk
+        with transaction.atomic(using=db):
+            # the oldest account keeps an email shared by several users
+            taken = set(
+                UserEmail.objects.using(db)
+                .filter(email__in=list(emails))
+                .values_list('email', flat=True)
+            )
+            UserEmail.objects.using(db).bulk_create(
+                UserEmail(user_id=pk, email=email)
+                for email, pk in emails.items() if email not in taken
+            )
+
+
+class Migration(migrations.Migration):
+    atomic = False
+
+    dependencies = [
+        ('main', '0003_useremail'),
+    ]
+
+    operations = [
+        migrations.RunPython(backfill, migrations.RunPython.noop),
+    ]
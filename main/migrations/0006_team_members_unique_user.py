@@ -0,0 +1,41 @@
+# -*- coding: utf-8 -*-
+# Generated by Django 1.11.8 on 2026-10-18 09:40
+from __future__ import unicode_literals
+
+from django.db import migrations
+from django.db.models import Count, Min
+
+
+def remove_extra_memberships(apps, schema_editor):
+    Team = apps.get_model('main', 'Team')
+    Membership = Team.members.through
+    db = schema_editor.connection.alias
+
+    # users who joined a second team through a race keep the first one
+    duplicates = (
+        Membership.objects.using(db)
+        .values('user_id')
+        .annotate(count=Count('pk'), first=Min('pk'))
+        .filter(count__gt=1)
+    )
+    for row in duplicates:
+        Membership.objects.using(db).filter(
+            user_id=row['user_id']
+        ).exclude(pk=row['first']).delete()
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('main', '0005_team_version'),
+    ]
+
+    operations = [
+        migrations.RunPython(remove_extra_memberships, migrations.RunPython.noop),
+        # a user belongs to one team at most, see CreateTeamView
+        migrations.RunSQL(
+            ['CREATE UNIQUE INDEX main_team_members_user_id_uniq '
+             'ON main_team_members (user_id)'],
+            ['DROP INDEX main_team_members_user_id_uniq'],
+        ),
+    ]
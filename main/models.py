@@ -3,8 +3,127 @@ from __future__ import unicode_literals
 
 from django.db import models
 from django.contrib.auth import get_user_model
+from django.utils import timezone
+
+
+def normalize_email(email):
+    return (email or '').strip().lower()
+
+
+class UserEmailManager(models.Manager):
+
+    def get_user(self, email, using=None):
+        """
+        Returns the user owning the email, ignoring case, or None.
+        """
+        return get_user_model().objects.using(using).filter(
+            normalized_email__email=normalize_email(email)
+        ).first()
+
+    def existing(self, emails):
+        """
+        Returns the normalized form of the emails that belong to a user.
+        """
+        return set(
+            self.filter(email__in=[normalize_email(e) for e in emails])
+            .values_list('email', flat=True)
+        )
+
+
+class TeamManager(models.Manager):
+
+    def bump_version(self, team_ids):
+        """
+        Marks the teams as changed for conditional requests.
+        """
+        return self.filter(pk__in=list(team_ids)).update(
+            version=models.F('version') + 1,
+            updated_at=timezone.now()
+        )
 
 
 class Team(models.Model):
     name = models.CharField(max_length=64, unique=True)
     members = models.ManyToManyField(get_user_model(), related_name='teams')
+    # bumped on every change of the team or its members, see main.signals
+    version = models.PositiveIntegerField(default=1)
+    updated_at = models.DateTimeField(default=timezone.now)
+
+    objects = TeamManager()
+
+    def save(self, *args, **kwargs):
+        if self.pk is None:
+            return super(Team, self).save(*args, **kwargs)
+        # increment in the database so concurrent bumps are not overwritten
+        self.version = models.F('version') + 1
+        self.updated_at = timezone.now()
+        super(Team, self).save(*args, **kwargs)
+        self.refresh_from_db(fields=['version'])
+
+
+class OutgoingEmail(models.Model):
+    STATUS_PENDING = 'pending'
+    STATUS_SENT = 'sent'
+    STATUS_DEAD = 'dead'
+    STATUS_CHOICES = (
+        (STATUS_PENDING, 'Pending'),
+        (STATUS_SENT, 'Sent'),
+        (STATUS_DEAD, 'Dead'),
+    )
+
+    subject = models.CharField(max_length=255)
+    message = models.TextField()
+    from_email = models.CharField(max_length=254)
+    recipients = models.TextField()
+    status = models.CharField(
+        max_length=16,
+        choices=STATUS_CHOICES,
+        default=STATUS_PENDING
+    )
+    attempts = models.PositiveIntegerField(default=0)
+    next_attempt_at = models.DateTimeField(default=timezone.now)
+    last_error = models.TextField(blank=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+    sent_at = models.DateTimeField(null=True, blank=True)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['status', 'next_attempt_at']),
+        ]
+
+    def recipient_list(self):
+        return [r for r in self.recipients.split(',') if r]
+
+
+class UserEmail(models.Model):
+    """
+    Case-folded copy of the user's email with a unique index. Kept in sync
+    by ``main.signals`` and used for every lookup by email.
+
+    ``pending_confirmation`` marks the users who registered themselves and
+    have not followed the confirmation link yet, the only ones the purge
+    command deletes.
+    """
+    user = models.OneToOneField(
+        get_user_model(),
+        on_delete=models.CASCADE,
+        primary_key=True,
+        related_name='normalized_email'
+    )
+    email = models.CharField(max_length=254, unique=True)
+    pending_confirmation = models.BooleanField(default=False)
+
+    objects = UserEmailManager()
+
+
+class IdempotencyKey(models.Model):
+    """
+    A key sent in an ``Idempotency-Key`` header, see ``main.idempotency``.
+    The request holding it has ``token``, until it stores the ``record``
+    of its response. Expired rows are deleted by the purge command.
+    """
+    key = models.CharField(max_length=255, primary_key=True)
+    fingerprint = models.CharField(max_length=64)
+    token = models.CharField(max_length=32)
+    record = models.TextField(null=True)
+    expires_at = models.DateTimeField(db_index=True)
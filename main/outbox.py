@@ -0,0 +1,184 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+import hashlib
+import logging
+import time
+from collections import OrderedDict
+from contextlib import contextmanager
+from datetime import timedelta
+
+from django.conf import settings
+from django.core.cache import caches
+from django.core.mail import EmailMessage, get_connection
+from django.db import transaction
+from django.template.loader import render_to_string
+from django.utils import timezone
+
+from main.metrics import email_render_duration, email_send_duration
+from main.models import OutgoingEmail, normalize_email
+
+logger = logging.getLogger(__name__)
+
+
+def render_email(template_name, context):
+    """
+    ``render_to_string`` for email bodies, timed per template.
+    """
+    with email_render_duration.time(template=template_name):
+        return render_to_string(template_name, context)
+
+
+def enqueue_mail(subject, message, from_email, recipient_list):
+    """
+    Drop-in replacement for ``send_mail`` that stores the email in the
+    outbox. It is written in the caller's transaction and delivered later
+    by the ``send_outbox`` management command.
+    """
+    return OutgoingEmail.objects.create(
+        subject=subject,
+        message=message,
+        from_email=from_email,
+        recipients=','.join(recipient_list),
+    )
+
+
+@contextmanager
+def deduplicate(recipient_list, kind, scope=None):
+    """
+    Yields the recipients that were not sent a ``kind`` email about
+    ``scope``, a team or the password a link was made for, in the last
+    ``EMAIL_DEDUP_WINDOW`` seconds, and remembers them as sent in the
+    ``EMAIL_DEDUP_CACHE`` alias. They are forgotten again if the block
+    raises, so that a failed request does not suppress the retry.
+    """
+    window = getattr(settings, 'EMAIL_DEDUP_WINDOW', 0)
+    if not window:
+        yield list(recipient_list)
+        return
+
+    cache = caches[getattr(settings, 'EMAIL_DEDUP_CACHE', 'default')]
+    keys = OrderedDict(
+        ('main:email:{}:{}:{}'.format(
+            kind,
+            scope or '',
+            hashlib.sha1(normalize_email(recipient).encode('utf-8')).hexdigest()
+        ), recipient)
+        for recipient in recipient_list
+    )
+    # add() is atomic, of concurrent requests only one gets the key
+    if hasattr(cache, 'add_many'):
+        claimed = set(cache.add_many(dict.fromkeys(keys, True), window))
+    else:
+        claimed = set(key for key in keys if cache.add(key, True, window))
+    if len(claimed) < len(keys):
+        logger.debug('Suppressed %s duplicate %s emails', len(keys) - len(claimed), kind)
+    try:
+        yield [recipient for key, recipient in keys.items() if key in claimed]
+    except Exception:
+        cache.delete_many(list(claimed))
+        raise
+
+
+def enqueue_bulk_mail(subject, messages, from_email):
+    """
+    Queue an email for every ``(recipient, message)`` pair with a single
+    insert. The worker sends them over one SMTP connection.
+    """
+    return OutgoingEmail.objects.bulk_create([
+        OutgoingEmail(
+            subject=subject,
+            message=message,
+            from_email=from_email,
+            recipients=recipient,
+        )
+        for recipient, message in messages
+    ])
+
+
+def _retry_delay(attempts):
+    base = getattr(settings, 'OUTBOX_RETRY_DELAY', 60)
+    return timedelta(seconds=base * 2 ** (attempts - 1))
+
+
+def _claim_batch(batch_size):
+    """
+    Lease a batch of due emails so that concurrent workers skip them
+    while they are being delivered.
+    """
+    now = timezone.now()
+    lease = timedelta(seconds=getattr(settings, 'OUTBOX_LEASE', 300))
+    with transaction.atomic():
+        batch = list(
+            OutgoingEmail.objects
+            .select_for_update(skip_locked=True)
+            .filter(
+                status=OutgoingEmail.STATUS_PENDING,
+                next_attempt_at__lte=now
+            )
+            .order_by('next_attempt_at', 'id')[:batch_size]
+        )
+        OutgoingEmail.objects.filter(
+            pk__in=[email.pk for email in batch]
+        ).update(next_attempt_at=now + lease)
+    return batch
+
+
+def deliver_batch(batch_size=None, connection=None):
+    """
+    Send one batch of due emails over a single SMTP connection.
+
+    Returns a ``(sent, failed)`` tuple. Emails that keep failing are
+    retried with exponential backoff and moved to the dead state after
+    ``OUTBOX_MAX_ATTEMPTS`` attempts.
+    """
+    batch_size = batch_size or getattr(settings, 'OUTBOX_BATCH_SIZE', 100)
+    max_attempts = getattr(settings, 'OUTBOX_MAX_ATTEMPTS', 5)
+    batch = _claim_batch(batch_size)
+    if not batch:
+        return 0, 0
+
+    sent = failed = 0
+    connection = connection or get_connection()
+    connection.open()
+    try:
+        for email in batch:
+            email.attempts += 1
+            started = time.time()
+            try:
+                EmailMessage(
+                    subject=email.subject,
+                    body=email.message,
+                    from_email=email.from_email,
+                    to=email.recipient_list(),
+                    connection=connection,
+                ).send()
+            except Exception as e:
+                email_send_duration.observe(time.time() - started, status='failed')
+                logger.warning('Outbox email %s failed: %s', email.pk, e)
+                failed += 1
+                email.last_error = '{}: {}'.format(type(e).__name__, e)
+                if email.attempts >= max_attempts:
+                    email.status = OutgoingEmail.STATUS_DEAD
+                else:
+                    email.next_attempt_at = (
+                        timezone.now() + _retry_delay(email.attempts)
+                    )
+            else:
+                email_send_duration.observe(time.time() - started, status='sent')
+                sent += 1
+                email.status = OutgoingEmail.STATUS_SENT
+                email.sent_at = timezone.now()
+                # bodies may carry credentials, keep them only until delivery
+                email.message = ''
+            email.save(update_fields=[
+                'attempts', 'status', 'sent_at', 'message',
+                'next_attempt_at', 'last_error'
+            ])
+            if email.status != OutgoingEmail.STATUS_SENT:
+                # the SMTP session may be broken, start a fresh one
+                connection.close()
+                connection.open()
+    finally:
+        connection.close()
+    return sent, failed
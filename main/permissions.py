@@ -1,16 +1,18 @@
 from rest_framework.permissions import BasePermission
 
+from main.membership import get_teams
+
 
 class IsHaveNotGotTeam(BasePermission):
 
     def has_permission(self, request, view):
-        return not request.user.teams.exists()
+        return not get_teams(request.user)
 
 
 class IsHaveGotTeam(BasePermission):
 
     def has_permission(self, request, view):
-        return request.user.teams.exists()
+        return bool(get_teams(request.user))
 
 
 class IsNotAuthenticated(BasePermission):
@@ -0,0 +1,68 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+import io
+import os
+import sys
+import threading
+import time
+import uuid
+from collections import Counter
+
+
+class StackSampler(object):
+    """
+    Samples the stack of one thread from a background thread every
+    ``interval`` seconds. The profiled code is not traced, so it runs at
+    full speed apart from the GIL switches of the sampler.
+    """
+
+    def __init__(self, thread_id, interval=0.001):
+        self.thread_id = thread_id
+        self.interval = interval
+        self.stacks = Counter()
+        self._stopped = threading.Event()
+        self._thread = threading.Thread(target=self._run)
+        self._thread.daemon = True
+
+    def start(self):
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._stopped.set()
+        self._thread.join()
+
+    def _run(self):
+        while not self._stopped.wait(self.interval):
+            frame = sys._current_frames().get(self.thread_id)
+            if frame is not None:
+                self.stacks[self.fold(frame)] += 1
+
+    @staticmethod
+    def fold(frame):
+        names = []
+        while frame is not None:
+            code = frame.f_code
+            names.append('{} ({}:{})'.format(
+                code.co_name, code.co_filename, code.co_firstlineno
+            ).replace(';', ':'))
+            frame = frame.f_back
+        return ';'.join(reversed(names))
+
+    def write(self, path):
+        """
+        Writes the samples in the folded format read by flamegraph.pl and
+        speedscope: one ``root;...;leaf count`` line per distinct stack.
+        """
+        with io.open(path, 'w', encoding='utf-8') as f:
+            for stack, count in self.stacks.most_common():
+                f.write('{} {}\n'.format(stack, count))
+
+
+def profile_path(directory, name):
+    return os.path.join(directory, '{}-{}-{}.folded'.format(
+        time.strftime('%Y%m%d-%H%M%S'),
+        name.replace(':', '.'),
+        uuid.uuid4().hex[:8]
+    ))
@@ -0,0 +1,102 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+import time
+from collections import namedtuple
+from datetime import timedelta
+
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.contrib.sessions.models import Session
+from django.core.cache import caches
+from django.db import transaction
+from django.utils import timezone
+
+from main.models import IdempotencyKey
+
+PurgeResult = namedtuple('PurgeResult', 'deleted chunks seconds')
+
+
+def purge(queryset, chunk_size=500, pause=0):
+    """
+    Deletes the rows of ``queryset`` in chunks of ``chunk_size``, each in
+    its own short transaction, and returns a ``PurgeResult``.
+
+    Chunks are read in primary key order from where the previous one
+    stopped, so every chunk is an index range scan and rows that were
+    already kept are not read again. The filter is applied again in the
+    delete, so rows changed since they were read are kept. Sleeping
+    ``pause`` seconds between chunks lets live requests take the write
+    lock.
+    """
+    started = time.time()
+    deleted = chunks = 0
+    last_pk = None
+    while True:
+        page = queryset.order_by('pk')
+        if last_pk is not None:
+            page = page.filter(pk__gt=last_pk)
+        pks = list(page.values_list('pk', flat=True)[:chunk_size])
+        if not pks:
+            break
+        last_pk = pks[-1]
+        with transaction.atomic():
+            _, counts = queryset.filter(pk__in=pks).delete()
+        deleted += counts.get(queryset.model._meta.label, 0)
+        chunks += 1
+        if len(pks) < chunk_size:
+            break
+        if pause:
+            time.sleep(pause)
+    return PurgeResult(deleted, chunks, time.time() - started)
+
+
+def unconfirmed_users(now=None):
+    """
+    Users who registered but never followed the confirmation link before
+    it expired. Users created otherwise, like the imported ones or those
+    deactivated by an admin, are never pending a confirmation and are kept.
+    """
+    now = now or timezone.now()
+    # a link made on day D is accepted until the end of day
+    # D + PASSWORD_RESET_TIMEOUT_DAYS
+    cutoff = now - timedelta(days=settings.PASSWORD_RESET_TIMEOUT_DAYS + 1)
+    return get_user_model().objects.filter(
+        normalized_email__pending_confirmation=True,
+        is_active=False,
+        is_staff=False,
+        is_superuser=False,
+        last_login__isnull=True,
+        date_joined__lt=cutoff,
+        teams=None,
+    )
+
+
+def expired_sessions(now=None):
+    return Session.objects.filter(expire_date__lt=now or timezone.now())
+
+
+def expired_idempotency_keys(now=None):
+    return IdempotencyKey.objects.filter(expires_at__lt=now or timezone.now())
+
+
+def purge_unconfirmed_users(chunk_size=500, pause=0):
+    return purge(unconfirmed_users(), chunk_size, pause)
+
+
+def purge_expired_sessions(chunk_size=500, pause=0):
+    return purge(expired_sessions(), chunk_size, pause)
+
+
+def purge_expired_idempotency_keys(chunk_size=500, pause=0):
+    return purge(expired_idempotency_keys(), chunk_size, pause)
+
+
+def purge_expired_cache_entries(chunk_size=500, pause=0):
+    """
+    Deletes the expired entries of the ``shared`` cache in one statement:
+    they are few, kept for EMAIL_DEDUP_WINDOW.
+    """
+    started = time.time()
+    deleted = caches['shared'].delete_expired()
+    return PurgeResult(deleted, 1, time.time() - started)
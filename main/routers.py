@@ -0,0 +1,48 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.conf import settings
+from django.db import DEFAULT_DB_ALIAS, connections
+
+REPLICA_DB_ALIAS = 'replica'
+
+# Models always read from the primary: a session read just after login or
+# logout, an email claimed by the outbox worker, an idempotency key or a
+# key of the shared cache, must not lag behind.
+PRIMARY_ONLY = (
+    'sessions.session',
+    'main.outgoingemail',
+    'main.idempotencykey',
+    'django_cache.cacheentry',
+)
+
+
+class PrimaryReplicaRouter(object):
+    """
+    Sends writes to the primary (``default``) database and reads to the
+    ``replica`` alias when it is configured.
+
+    Reads made inside a transaction on the primary stay there, so that
+    they see the transaction's own writes and the rows it has locked.
+    Models in ``PRIMARY_ONLY`` are always read from the primary.
+    """
+
+    def db_for_read(self, model, **hints):
+        if REPLICA_DB_ALIAS not in settings.DATABASES:
+            return DEFAULT_DB_ALIAS
+        # the cache model of DatabaseCache has no label_lower
+        if '{}.{}'.format(model._meta.app_label, model._meta.model_name) in PRIMARY_ONLY:
+            return DEFAULT_DB_ALIAS
+        if connections[DEFAULT_DB_ALIAS].in_atomic_block:
+            return DEFAULT_DB_ALIAS
+        return REPLICA_DB_ALIAS
+
+    def db_for_write(self, model, **hints):
+        return DEFAULT_DB_ALIAS
+
+    def allow_relation(self, obj1, obj2, **hints):
+        # both aliases hold the same data
+        return True
+
+    def allow_migrate(self, db, app_label, model_name=None, **hints):
+        return db == DEFAULT_DB_ALIAS
@@ -1,33 +1,65 @@
+from collections import OrderedDict
+
 from rest_framework import serializers
-from rest_framework.validators import UniqueValidator
 from django.contrib.auth import get_user_model
+from django.contrib.auth.hashers import make_password
+from django.core.exceptions import ValidationError
+from django.core.validators import validate_email
+from django.db import transaction
 
-from main.models import Team
+from main import usercache
+from main.models import Team, UserEmail, normalize_email
+from main.token import team_invite_token
 
 
 class CreateUserSerializer(serializers.ModelSerializer):
-    email = serializers.EmailField(
-        required=True,
-        validators=[
-            UniqueValidator(queryset=get_user_model().objects.all())
-        ]
-    )
+    email = serializers.EmailField(required=True)
     password = serializers.CharField(
         min_length=6,
         write_only=True
     )
 
+    def validate_email(self, value):
+        if UserEmail.objects.filter(email=normalize_email(value)).exists():
+            raise serializers.ValidationError('This field must be unique.')
+        return value
+
+    def validate(self, attrs):
+        invite = self.context.get('invite')
+        if invite:
+            team_id = team_invite_token.check_token(invite, attrs['email'])
+            if team_id is None:
+                raise serializers.ValidationError({
+                    'invite': 'Invite is invalid, expired or sent to another email'
+                })
+            attrs['team_id'] = team_id
+        # hashed here, outside of the transaction that creates the user
+        attrs['password'] = make_password(attrs['password'])
+        return attrs
+
+    @transaction.atomic(savepoint=False)
     def create(self, validated_data):
-        nickname = validated_data.get('email')
-        team = self.context.get('team', None)
-        instance = self.Meta.model.objects.create_user(
-            username=nickname,
-            is_active=True if team else False,
+        User = self.Meta.model
+        email = User.objects.normalize_email(validated_data.pop('email'))
+        team_id = validated_data.pop('team_id', None)
+        # locks the team row until the membership is committed, and finds
+        # a team deleted since the invite was sent: sqlite does not check
+        # the foreign key of the membership
+        if team_id is not None and not Team.objects.bump_version([team_id]):
+            raise serializers.ValidationError({'invite': 'Invite is invalid or expired'})
+        instance = User.objects.create(
+            username=User.normalize_username(email),
+            email=email,
+            is_active=team_id is not None,
             **validated_data
         )
-        if team and Team.objects.filter(name=team).exists():
-            team_instance = Team.objects.get(name=team)
-            team_instance.members.add(instance)
+        if team_id is not None:
+            Team.members.through.objects.create(
+                team_id=team_id,
+                user_id=instance.pk
+            )
+        else:
+            UserEmail.objects.filter(user=instance).update(pending_confirmation=True)
 
         return instance
 
@@ -45,7 +77,7 @@ class ForgotPasswordSerializer(serializers.Serializer):
     email = serializers.EmailField()
 
     def validate_email(self, value):
-        user = get_user_model().objects.filter(email=value).first()
+        user = usercache.get_user_by_email(value)
         if user:
             return user
         else:
@@ -73,7 +105,7 @@ class SetPasswordSerializer(serializers.ModelSerializer):
     def update(self, instance, validated_data):
         if instance.check_password(validated_data.get('old_password')):
             instance.set_password(validated_data.get('new_password'))
-            instance.save()
+            instance.save(update_fields=['password'])
             return instance
         else:
             raise serializers.ValidationError('Invalid password')
@@ -86,13 +118,16 @@ class CreateTeamSerializer(serializers.ModelSerializer):
         model = Team
         fields = ('name', )
 
+    # part of the caller's transaction if there is one, without a savepoint
+    @transaction.atomic(savepoint=False)
     def create(self, validated_data):
         user = self.context.get('user')
         name = validated_data.get('name')
         instance = Team.objects.create(
             name=name
         )
-        instance.save()
+        # a user joins one team at most, the unique index on
+        # main_team_members.user_id rejects a concurrent second team
         instance.members.add(user)
         return instance
 
@@ -101,6 +136,52 @@ class InviteSerializer(serializers.Serializer):
     email = serializers.EmailField()
 
     def validate_email(self, value):
-        if get_user_model().objects.filter(email=value).exists():
+        if usercache.get_user_by_email(value) is not None:
             raise serializers.ValidationError('Email is already exists')
         return value
+
+
+class BulkInviteSerializer(serializers.Serializer):
+    emails = serializers.ListField(
+        child=serializers.CharField(),
+        allow_empty=False,
+        max_length=1000
+    )
+
+    def split_emails(self):
+        """
+        Returns a list of emails to invite and an ordered dict of
+        rejected emails with the reason. Existing users are looked up
+        with a single query for the whole list.
+        """
+        valid, errors = OrderedDict(), OrderedDict()
+        for email in self.validated_data['emails']:
+            email = email.strip()
+            if email in errors or normalize_email(email) in valid:
+                continue
+            try:
+                validate_email(email)
+            except ValidationError:
+                errors[email] = 'Enter a valid email address.'
+            else:
+                valid[normalize_email(email)] = email
+
+        existing = UserEmail.objects.existing(valid)
+        for normalized in existing:
+            errors[valid.pop(normalized)] = 'Email is already exists'
+        return list(valid.values()), errors
+
+
+class TeamSerializer(serializers.ModelSerializer):
+    member_count = serializers.IntegerField(read_only=True)
+
+    class Meta:
+        model = Team
+        fields = ('id', 'name', 'version', 'member_count')
+
+
+class MemberSerializer(serializers.ModelSerializer):
+
+    class Meta:
+        model = get_user_model()
+        fields = ('id', 'email', 'first_name', 'last_name')
@@ -0,0 +1,28 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.contrib.sessions.backends import db
+
+from main.metrics import session_duration
+
+
+class SessionStore(db.SessionStore):
+    """
+    Database sessions, timing every read and write.
+    """
+
+    def load(self):
+        with session_duration.time(operation='load'):
+            return super(SessionStore, self).load()
+
+    def exists(self, session_key):
+        with session_duration.time(operation='exists'):
+            return super(SessionStore, self).exists(session_key)
+
+    def save(self, must_create=False):
+        with session_duration.time(operation='save'):
+            return super(SessionStore, self).save(must_create)
+
+    def delete(self, session_key=None):
+        with session_duration.time(operation='delete'):
+            return super(SessionStore, self).delete(session_key)
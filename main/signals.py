@@ -0,0 +1,58 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.contrib.auth import get_user_model
+from django.db.models.signals import m2m_changed, post_delete, post_save, pre_delete
+from django.dispatch import receiver
+
+from main import usercache
+from main.models import Team, UserEmail, normalize_email
+
+
+@receiver(post_save, sender=get_user_model())
+def sync_user_email(sender, instance, created, update_fields, **kwargs):
+    if update_fields is not None and 'email' not in update_fields:
+        return
+    email = normalize_email(instance.email)
+    if not email:
+        UserEmail.objects.filter(user=instance).delete()
+    elif created:
+        UserEmail.objects.create(user=instance, email=email)
+    else:
+        UserEmail.objects.update_or_create(
+            user=instance,
+            defaults={'email': email}
+        )
+
+
+@receiver(m2m_changed, sender=Team.members.through)
+def bump_team_version(sender, instance, action, reverse, pk_set, **kwargs):
+    if action in ('post_add', 'post_remove'):
+        if pk_set:
+            Team.objects.bump_version(pk_set if reverse else [instance.pk])
+    elif action == 'pre_clear' and reverse:
+        instance._cleared_team_ids = list(
+            instance.teams.values_list('pk', flat=True)
+        )
+    elif action == 'post_clear':
+        if reverse:
+            Team.objects.bump_version(instance.__dict__.pop('_cleared_team_ids', []))
+        else:
+            Team.objects.bump_version([instance.pk])
+
+
+@receiver(pre_delete, sender=get_user_model())
+def bump_deleted_user_teams(sender, instance, **kwargs):
+    # the membership rows go away with the user without m2m_changed
+    Team.objects.bump_version(instance.teams.values_list('pk', flat=True))
+
+
+@receiver(post_save, sender=get_user_model())
+@receiver(post_delete, sender=get_user_model())
+def invalidate_cached_user(sender, instance, created=False, update_fields=None, **kwargs):
+    # a new user was not cached, and login saves last_login alone, which
+    # nothing needs fresh
+    if created or update_fields is not None and set(update_fields) <= {'last_login'}:
+        return
+    # covers password changes, which are saved like any other field
+    usercache.invalidate(instance.pk)
@@ -0,0 +1,167 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+import threading
+import time
+from collections import OrderedDict
+
+from django.conf import settings
+from django.core.cache import caches
+from django.core.signals import setting_changed
+from django.dispatch import receiver
+from django.utils import six
+from django.utils.module_loading import import_string
+from rest_framework.throttling import BaseThrottle
+
+from main import metrics
+from main.models import normalize_email
+
+DURATIONS = {'s': 1, 'm': 60, 'h': 60 * 60, 'd': 24 * 60 * 60}
+
+
+class LocalBackend(object):
+    """
+    Sliding-window counters kept in this process, in an LRU dict bounded
+    to ``max_keys`` entries.
+    """
+
+    def __init__(self, max_keys=10000):
+        self.max_keys = max_keys
+        self._counters = OrderedDict()
+        self._lock = threading.Lock()
+
+    def hit(self, key, window):
+        """
+        Counts a hit and returns the number of hits in the last ``window``
+        seconds, interpolated from the current and previous fixed windows.
+        """
+        now = time.time()
+        index = int(now // window)
+        with self._lock:
+            counter = self._counters.pop(key, None)
+            if counter is None or counter[0] < index - 1:
+                counter = [index, 0, 0]
+            elif counter[0] == index - 1:
+                counter = [index, 0, counter[1]]
+            counter[1] += 1
+            self._counters[key] = counter
+            while len(self._counters) > self.max_keys:
+                self._counters.popitem(last=False)
+        _, current, previous = counter
+        return previous * (1 - (now % window) / window) + current
+
+    def reset(self):
+        with self._lock:
+            self._counters.clear()
+
+
+class CacheBackend(object):
+    """
+    Sliding-window counters kept in a Django cache, shared by every process
+    that uses the same cache.
+    """
+
+    def __init__(self, alias='default', prefix='throttle'):
+        self.cache = caches[alias]
+        self.prefix = prefix
+
+    def hit(self, key, window):
+        now = time.time()
+        index = int(now // window)
+        current_key = '{}:{}:{}'.format(self.prefix, key, index)
+        self.cache.add(current_key, 0, window * 2)
+        try:
+            current = self.cache.incr(current_key)
+        except ValueError:
+            # expired between add() and incr()
+            self.cache.set(current_key, 1, window * 2)
+            current = 1
+        previous = self.cache.get(
+            '{}:{}:{}'.format(self.prefix, key, index - 1), 0
+        )
+        return previous * (1 - (now % window) / window) + current
+
+    def reset(self):
+        self.cache.clear()
+
+
+_backend = None
+
+
+def get_backend():
+    global _backend
+    if _backend is None:
+        config = getattr(settings, 'THROTTLE', {})
+        backend_class = import_string(
+            config.get('BACKEND', 'main.throttling.LocalBackend')
+        )
+        _backend = backend_class(**config.get('OPTIONS', {}))
+    return _backend
+
+
+def reset():
+    get_backend().reset()
+
+
+@receiver(setting_changed)
+def reload_backend(setting, **kwargs):
+    global _backend
+    if setting == 'THROTTLE':
+        _backend = None
+
+
+def parse_rate(rate):
+    """
+    Turns '10/min' into ``(10, 60)``.
+    """
+    num, period = rate.split('/')
+    return int(num), DURATIONS[period[0]]
+
+
+class SlidingWindowThrottle(BaseThrottle):
+    """
+    Limits requests per ``<view.throttle_scope>_<kind>`` rate from
+    ``settings.THROTTLE['RATES']``. Subclasses define what to count by.
+    """
+    kind = None
+
+    def get_key(self, request):
+        raise NotImplementedError
+
+    def allow_request(self, request, view):
+        scope = '{}_{}'.format(view.throttle_scope, self.kind)
+        rate = getattr(settings, 'THROTTLE', {}).get('RATES', {}).get(scope)
+        key = rate and self.get_key(request)
+        if not key:
+            return True
+
+        self.num_requests, self.window = parse_rate(rate)
+        hits = get_backend().hit('{}:{}'.format(scope, key), self.window)
+        allowed = hits <= self.num_requests
+        metrics.throttle_requests.inc(
+            scope=scope, result='allowed' if allowed else 'rejected'
+        )
+        return allowed
+
+    def wait(self):
+        return self.window
+
+
+class IPRateThrottle(SlidingWindowThrottle):
+    kind = 'ip'
+
+    def get_key(self, request):
+        return self.get_ident(request)
+
+
+class EmailRateThrottle(SlidingWindowThrottle):
+    kind = 'email'
+
+    def get_key(self, request):
+        try:
+            email = request.data.get('email')
+        except AttributeError:
+            return None
+        if not isinstance(email, six.string_types):
+            return None
+        return normalize_email(email) or None
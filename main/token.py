@@ -1,5 +1,16 @@
+import hashlib
+
+from django.conf import settings
+from django.contrib.auth import get_user_model
 from django.contrib.auth.tokens import PasswordResetTokenGenerator
+from django.core import signing
+from django.core.cache import cache
+from django.db import router
 from django.utils import six
+from django.utils.encoding import force_bytes, force_text
+from django.utils.http import base36_to_int, urlsafe_base64_decode
+
+from main.models import normalize_email
 
 
 class RegisterToken(PasswordResetTokenGenerator):
@@ -13,11 +24,170 @@ class RegisterToken(PasswordResetTokenGenerator):
 
 class ForgotToken(PasswordResetTokenGenerator):
     def _make_hash_value(self, user, timestamp):
+        # the new password invalidates the link in every process
         return (
             six.text_type(user.pk) +
+            user.password +
             six.text_type(timestamp)
         )
 
 
+class TokenVerifier(object):
+    """
+    Checks ``uidb64``/``token`` pairs of the emailed links while keeping
+    guessed and replayed tokens away from the database.
+
+    Expired tokens are rejected from the timestamp embedded in them,
+    invalid pairs are remembered for ``TOKEN_NEGATIVE_CACHE_TIMEOUT``
+    seconds and consumed ones until they would have expired anyway.
+
+    Both are remembered by this process only. What makes a link single
+    use is the user row, read from the primary: the hash of a
+    registration link covers ``is_active`` and the hash of a forgot
+    password link the password.
+    """
+
+    def __init__(self, generator, name):
+        self.generator = generator
+        self.name = name
+
+    def _cache_key(self, uidb64, token):
+        return 'main:token:{}:{}'.format(
+            self.name,
+            hashlib.sha1(force_bytes(uidb64 + ':' + token)).hexdigest()
+        )
+
+    def _age_in_days(self, token):
+        try:
+            ts_b36, _ = token.split('-')
+            timestamp = base36_to_int(ts_b36)
+        except ValueError:
+            return None
+        age = self.generator._num_days(self.generator._today()) - timestamp
+        return age if age >= 0 else None
+
+    def get_user(self, uidb64, token):
+        """
+        Returns the user of a valid link, None otherwise.
+        """
+        age = self._age_in_days(token)
+        if age is None or age > settings.PASSWORD_RESET_TIMEOUT_DAYS:
+            return None
+        key = self._cache_key(uidb64, token)
+        if cache.get(key):
+            return None
+
+        try:
+            uid = force_text(urlsafe_base64_decode(uidb64))
+            User = get_user_model()
+            user = User.objects.using(router.db_for_write(User)).filter(pk=uid).first()
+        except (TypeError, ValueError, OverflowError):
+            user = None
+        if user is None or not self.generator.check_token(user, token):
+            cache.set(
+                key,
+                'invalid',
+                getattr(settings, 'TOKEN_NEGATIVE_CACHE_TIMEOUT', 5 * 60)
+            )
+            return None
+        return user
+
+    def consume(self, uidb64, token):
+        """
+        Marks a link as used so that replays are rejected without a query.
+        """
+        age = self._age_in_days(token)
+        remaining_days = settings.PASSWORD_RESET_TIMEOUT_DAYS - age + 1
+        cache.set(
+            self._cache_key(uidb64, token),
+            'consumed',
+            remaining_days * 24 * 60 * 60
+        )
+
+
+class ApiToken(object):
+    """
+    Signed, expiring bearer tokens carrying the user id.
+
+    Tokens are signed with the first key of ``API_TOKEN_KEYS`` and prefixed
+    with a key id, so older keys listed after it keep validating tokens
+    issued before a rotation. Checking a token never touches the database.
+    """
+    salt = 'main.token.ApiToken'
+
+    def _keys(self):
+        keys = getattr(settings, 'API_TOKEN_KEYS', None) or [settings.SECRET_KEY]
+        return [
+            (hashlib.sha256(force_bytes(key)).hexdigest()[:8], key)
+            for key in keys
+        ]
+
+    @property
+    def max_age(self):
+        return getattr(settings, 'API_TOKEN_MAX_AGE', 24 * 60 * 60)
+
+    def make_token(self, user):
+        key_id, key = self._keys()[0]
+        return '{}.{}'.format(
+            key_id,
+            signing.dumps(user.pk, key=key, salt=self.salt)
+        )
+
+    def check_token(self, token):
+        """
+        Returns the user id of a valid token, None otherwise.
+        """
+        key_id, _, value = token.partition('.')
+        key = dict(self._keys()).get(key_id)
+        if key is None:
+            return None
+        try:
+            return signing.loads(
+                value,
+                key=key,
+                salt=self.salt,
+                max_age=self.max_age
+            )
+        except signing.BadSignature:
+            return None
+
+
+class TeamInviteToken(object):
+    """
+    Signed, expiring invite tokens carrying the team id and the invited
+    email. Registering from an invite skips the email confirmation, so
+    the token is only valid for the address it was sent to.
+    """
+    salt = 'main.token.TeamInviteToken'
+
+    @property
+    def max_age(self):
+        return getattr(settings, 'TEAM_INVITE_MAX_AGE', 7 * 24 * 60 * 60)
+
+    def make_token(self, team_id, email):
+        return signing.dumps([team_id, normalize_email(email)], salt=self.salt)
+
+    def check_token(self, token, email):
+        """
+        Returns the team id of a valid token sent to ``email``, None
+        otherwise.
+        """
+        try:
+            value = signing.loads(token, salt=self.salt, max_age=self.max_age)
+        except signing.BadSignature:
+            return None
+        # tokens issued before the email was signed in carry the id only
+        if not isinstance(value, list) or len(value) != 2:
+            return None
+        team_id, invited = value
+        if invited != normalize_email(email):
+            return None
+        return team_id
+
+
 registration_token = RegisterToken()
 forgot_token = ForgotToken()
+registration_verifier = TokenVerifier(registration_token, 'registration')
+forgot_verifier = TokenVerifier(forgot_token, 'forgot')
+api_token = ApiToken()
+team_invite_token = TeamInviteToken()
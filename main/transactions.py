@@ -0,0 +1,45 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+import random
+import time
+
+from django.db import OperationalError, transaction
+
+# serialization_failure and deadlock_detected
+RETRYABLE_PGCODES = ('40001', '40P01')
+
+
+def is_retryable(error):
+    """
+    True for the errors after which the whole transaction can simply run
+    again: sqlite's lock timeouts, and serialization failures and
+    deadlocks on postgres.
+    """
+    if 'is locked' in str(error):
+        return True
+    cause = getattr(error, '__cause__', None)
+    return getattr(cause, 'pgcode', None) in RETRYABLE_PGCODES
+
+
+def atomic_with_retry(func, attempts=3, delay=0.05, using=None):
+    """
+    Runs ``func`` in a transaction and returns its result. The transaction
+    runs again, after a randomized backoff, when it fails with an error
+    that ``is_retryable``.
+
+    Inside another transaction a failure is raised at once: the outer
+    transaction is broken and only its owner can retry it.
+    """
+    for attempt in range(1, attempts + 1):
+        try:
+            with transaction.atomic(using=using):
+                return func()
+        except OperationalError as e:
+            if (
+                attempt == attempts or
+                not is_retryable(e) or
+                transaction.get_connection(using).in_atomic_block
+            ):
+                raise
+            time.sleep(delay * 2 ** (attempt - 1) * random.uniform(0.5, 1.5))
@@ -27,6 +27,11 @@ urlpatterns = [
         views.LoginUserView.as_view(),
         name='login_user'
     ),
+    url(
+        r'^token/',
+        views.ObtainTokenView.as_view(),
+        name='obtain_token'
+    ),
     url(
         r'^logout/',
         views.LogoutUserView.as_view(),
@@ -52,6 +57,36 @@ urlpatterns = [
         views.InviteView.as_view(),
         name='invite'
     ),
+    url(
+        r'^teams/$',
+        views.TeamListView.as_view(),
+        name='team_list'
+    ),
+    url(
+        r'^teams/(?P<pk>\d+)/$',
+        views.TeamDetailView.as_view(),
+        name='team_detail'
+    ),
+    url(
+        r'^teams/(?P<pk>\d+)/members/$',
+        views.TeamMembersView.as_view(),
+        name='team_members'
+    ),
+    url(
+        r'^throttle_stats/',
+        views.ThrottleStatsView.as_view(),
+        name='throttle_stats'
+    ),
+    url(
+        r'^export/(?P<kind>teams|members)\.(?P<fmt>ndjson|csv)$',
+        views.ExportView.as_view(),
+        name='export'
+    ),
+    url(
+        r'^metrics/',
+        views.MetricsView.as_view(),
+        name='metrics'
+    ),
     url(
         r'^(?P<uidb64>[0-9A-Za-z_\-]+)/(?P<token>[0-9A-Za-z]{1,13}-[0-9A-Za-z]{1,20})/',
         include([
@@ -0,0 +1,205 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+import threading
+import time
+import uuid
+from collections import OrderedDict
+
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.core.cache import caches
+from django.core.signals import setting_changed
+from django.db import router, transaction
+from django.dispatch import receiver
+
+from main.models import UserEmail, normalize_email
+
+VERSION_KEY = 'main:user:{}:version'
+
+
+class UserCache(object):
+    """
+    Users of this process by pk, in an LRU dict bounded to ``max_size``
+    entries that expire after ``timeout`` seconds, with an index of their
+    normalized emails.
+
+    Only the field values are kept: every lookup builds a new instance, so
+    that callers can change the user they get without changing the cache.
+    An entry may be stored with the shared ``version`` of the user it was
+    read at, and only be returned for that version.
+    """
+
+    def __init__(self, max_size=10000, timeout=30):
+        self.max_size = max_size
+        self.timeout = timeout
+        self._users = OrderedDict()
+        self._emails = {}
+        self._lock = threading.Lock()
+
+    def get(self, pk, version=None):
+        now = time.time()
+        with self._lock:
+            entry = self._users.pop(pk, None)
+            if entry is None:
+                return None
+            if entry[0] < now:
+                if self._emails.get(entry[1]) == pk:
+                    del self._emails[entry[1]]
+                return None
+            self._users[pk] = entry
+        _, _, db, values, entry_version = entry
+        if version is not None and entry_version != version:
+            return None
+        User = get_user_model()
+        return User.from_db(db, [f.attname for f in User._meta.concrete_fields], values)
+
+    def get_pk(self, email):
+        with self._lock:
+            return self._emails.get(email)
+
+    def set(self, user, version=None):
+        email = normalize_email(user.email)
+        entry = (
+            time.time() + self.timeout,
+            email,
+            user._state.db,
+            [getattr(user, f.attname) for f in user._meta.concrete_fields],
+            version,
+        )
+        with self._lock:
+            self._remove(user.pk)
+            self._users[user.pk] = entry
+            if email:
+                self._emails[email] = user.pk
+            while len(self._users) > self.max_size:
+                _, (_, old_email, _, _, _) = self._users.popitem(last=False)
+                self._emails.pop(old_email, None)
+
+    def invalidate(self, pk):
+        with self._lock:
+            self._remove(pk)
+
+    def clear(self):
+        with self._lock:
+            self._users.clear()
+            self._emails.clear()
+
+    def _remove(self, pk):
+        entry = self._users.pop(pk, None)
+        if entry is not None and self._emails.get(entry[1]) == pk:
+            del self._emails[entry[1]]
+
+
+_cache = None
+
+
+def get_cache():
+    global _cache
+    if _cache is None:
+        _cache = UserCache(
+            max_size=getattr(settings, 'USER_CACHE_MAX_SIZE', 10000),
+            timeout=getattr(settings, 'USER_CACHE_TIMEOUT', 30),
+        )
+    return _cache
+
+
+@receiver(setting_changed)
+def reload_cache(setting, **kwargs):
+    global _cache
+    if setting in ('USER_CACHE_MAX_SIZE', 'USER_CACHE_TIMEOUT'):
+        _cache = None
+
+
+def get_user(pk):
+    """
+    Returns the user with the pk, or None. Read through the cache.
+    """
+    user = get_cache().get(pk)
+    if user is None:
+        user = get_user_model()._default_manager.filter(pk=pk).first()
+        if user is not None:
+            get_cache().set(user)
+    return user
+
+
+def get_user_by_email(email):
+    """
+    Returns the user owning the email, ignoring case, or None. Read
+    through the cache, only existing users are cached.
+    """
+    email = normalize_email(email)
+    pk = get_cache().get_pk(email)
+    user = get_cache().get(pk) if pk is not None else None
+    if user is None:
+        user = UserEmail.objects.get_user(email)
+        if user is not None:
+            get_cache().set(user)
+    return user
+
+
+def get_session_user(pk):
+    """
+    Returns the user with the pk, or None, for checking a session.
+
+    The cached user is only returned while its shared version, bumped by
+    ``invalidate`` in whatever process changes the user, is the one it was
+    cached at: a password changed in another process must end the
+    sessions signed with the old one at once. Otherwise the user is read
+    from the primary.
+    """
+    # read before the row, so that a change made in between bumps it again
+    version = _versions().get(VERSION_KEY.format(pk)) or ''
+    user = get_cache().get(pk, version)
+    if user is None:
+        User = get_user_model()
+        user = User._default_manager.using(router.db_for_write(User)).filter(pk=pk).first()
+        if user is not None:
+            get_cache().set(user, version)
+    return user
+
+
+def set_user(user):
+    """
+    Caches a user just read from the database.
+    """
+    get_cache().set(user)
+
+
+def invalidate(pk):
+    invalidate_many([pk])
+
+
+def invalidate_many(pks):
+    """
+    Drops the users from the cache of this process, and from the session
+    checks of every process by bumping their shared versions.
+    """
+    pks = list(pks)
+    for pk in pks:
+        get_cache().invalidate(pk)
+    _bump_versions(pks)
+    connection = transaction.get_connection(router.db_for_write(get_user_model()))
+    if connection.in_atomic_block:
+        # again once committed: a process may have read the new version
+        # and then the row as it was before the commit
+        transaction.on_commit(lambda: _bump_versions(pks), using=connection.alias)
+
+
+def _versions():
+    return caches[getattr(settings, 'USER_CACHE_VERSIONS', 'shared')]
+
+
+def _bump_versions(pks):
+    if not pks:
+        return
+    version = uuid.uuid4().hex
+    _versions().set_many(
+        dict((VERSION_KEY.format(pk), version) for pk in pks),
+        # outlives the entries cached before it was set
+        2 * get_cache().timeout + 1
+    )
+
+
+def clear():
+    get_cache().clear()
@@ -1,29 +1,52 @@
 # -*- coding: utf-8 -*-
 from __future__ import unicode_literals
 
+from calendar import timegm
+
+from django.conf import settings
 from django.contrib.auth import get_user_model, login, authenticate, logout
 from django.contrib.sites.shortcuts import get_current_site
-from django.core.mail import send_mail
-from django.http import JsonResponse
-from django.template.loader import render_to_string
+from django.db import IntegrityError, router, transaction
+from django.db.models import Count
+from django.http import Http404, HttpResponse, JsonResponse, StreamingHttpResponse
+from django.middleware.gzip import re_accepts_gzip
 from django.urls import reverse
-from django.utils.encoding import force_text, force_bytes
-from django.utils.http import urlsafe_base64_decode, urlsafe_base64_encode
+from django.utils.cache import get_conditional_response, patch_vary_headers
+from django.utils.crypto import salted_hmac
+from django.utils.encoding import force_bytes
+from django.utils.http import http_date, urlsafe_base64_encode
+from django.views.generic import View
 
 from rest_framework import status
 from rest_framework.generics import (
     CreateAPIView,
-    get_object_or_404,
     UpdateAPIView,
-    GenericAPIView
+    GenericAPIView,
+    ListAPIView,
+    RetrieveAPIView,
 )
 from rest_framework.response import Response
-from rest_framework.permissions import IsAuthenticated
+from rest_framework.permissions import IsAuthenticated, IsAdminUser
 from rest_framework.views import APIView
 
-from main.models import Team
+from main.export import CONTENT_TYPES, export
+from main.idempotency import IdempotencyMixin
+from main.membership import get_teams
+from main.models import Team, UserEmail, normalize_email
+from main.outbox import deduplicate, enqueue_mail, enqueue_bulk_mail, render_email
+from main import metrics, usercache
+from main.pagination import IdCursorPagination
 from main.permissions import IsHaveNotGotTeam, IsHaveGotTeam, IsNotAuthenticated
-from main.token import registration_token, forgot_token
+from main.throttling import IPRateThrottle, EmailRateThrottle
+from main.transactions import atomic_with_retry
+from main.token import (
+    registration_token,
+    forgot_token,
+    registration_verifier,
+    forgot_verifier,
+    api_token,
+    team_invite_token,
+)
 from main.serializers import (
     CreateUserSerializer,
     ForgotPasswordSerializer,
@@ -31,47 +54,89 @@ from main.serializers import (
     SetPasswordSerializer,
     CreateTeamSerializer,
     InviteSerializer,
+    BulkInviteSerializer,
+    TeamSerializer,
+    MemberSerializer,
 )
 
 
-class RegisterUserView(CreateAPIView):
+class RegisterUserView(IdempotencyMixin, CreateAPIView):
+    query_budget = 17
     serializer_class = CreateUserSerializer
     permission_classes = (IsNotAuthenticated, )
+    throttle_classes = (IPRateThrottle, EmailRateThrottle)
+    throttle_scope = 'register'
 
     def get_serializer_context(self):
         context = super(RegisterUserView, self).get_serializer_context()
-        context['team'] = self.request.query_params.get('team')
+        context['invite'] = self.request.query_params.get('invite')
         return context
 
     def post(self, request, *args, **kwargs):
         serializer = self.get_serializer(
             data=self.request.data,
         )
+        # validation hashes the password, keep it out of the transaction
         serializer.is_valid(raise_exception=True)
+        try:
+            user = atomic_with_retry(lambda: self.create_user(serializer))
+        except IntegrityError:
+            response = self.conflict(serializer.validated_data)
+            if response is None:
+                raise
+            return response
+        if not user.is_active:
+            return Response({'data': 'Check your email'}, status=status.HTTP_201_CREATED)
+        else:
+            login(request, user, backend='main.backends.EmailBackend')
+            return Response({'url': reverse('main:create_team')}, status=status.HTTP_201_CREATED)
+
+    def create_user(self, serializer):
         user = serializer.save()
         if not user.is_active:
             token = registration_token.make_token(user)
-            message = render_to_string('confirmation_email.html', {
+            message = render_email('confirmation_email.html', {
                 'site': get_current_site(self.request).domain,
                 'token': token,
                 'uid': urlsafe_base64_encode(force_bytes(user.pk))
             })
-            send_mail(
+            enqueue_mail(
                 subject='Confirm your email',
                 message=message,
                 from_email='t998691@mvrht.net',
                 recipient_list=[user.email]
 
             )
-            return Response({'data': 'Check your email'}, status=status.HTTP_201_CREATED)
-        else:
-            login(request, user, backend='django.contrib.auth.backends.ModelBackend')
-            return Response({'url': reverse('main:create_team')}, status=status.HTTP_201_CREATED)
+        return user
+
+    def conflict(self, validated_data):
+        """
+        Response to a registration that lost a race: the email was taken,
+        or the invited team deleted, after validation. None for other
+        integrity errors.
+        """
+        db = router.db_for_write(UserEmail)
+        email = normalize_email(validated_data['email'])
+        if UserEmail.objects.using(db).filter(email=email).exists():
+            return Response(
+                {'email': ['This field must be unique.']},
+                status=status.HTTP_400_BAD_REQUEST
+            )
+        team_id = validated_data.get('team_id')
+        if team_id is not None and not Team.objects.using(db).filter(pk=team_id).exists():
+            return Response(
+                {'invite': 'Invite is invalid or expired'},
+                status=status.HTTP_400_BAD_REQUEST
+            )
+        return None
 
 
 class LoginUserView(CreateAPIView):
+    query_budget = 14
     serializer_class = LoginUserSerializer
     permission_classes = (IsNotAuthenticated, )
+    throttle_classes = (IPRateThrottle, EmailRateThrottle)
+    throttle_scope = 'login'
 
     def post(self, request, *args, **kwargs):
         serializer = self.serializer_class(data=request.data)
@@ -92,41 +157,78 @@ class LoginUserView(CreateAPIView):
             )
 
 
-class ForgotPasswordView(CreateAPIView):
+class ObtainTokenView(CreateAPIView):
+    query_budget = 1
+    serializer_class = LoginUserSerializer
+    throttle_classes = (IPRateThrottle, EmailRateThrottle)
+    throttle_scope = 'login'
+
+    def post(self, request, *args, **kwargs):
+        serializer = self.serializer_class(data=request.data)
+        serializer.is_valid(raise_exception=True)
+        email = serializer.validated_data.get('email')
+        password = serializer.validated_data.get('password')
+        user = authenticate(username=email, password=password)
+        if user and user.is_active:
+            return Response(
+                {
+                    'token': api_token.make_token(user),
+                    'expires_in': api_token.max_age
+                },
+                status=status.HTTP_200_OK
+            )
+        else:
+            return Response(
+                {'error': 'Invalid user'},
+                status=status.HTTP_400_BAD_REQUEST
+            )
+
+
+class ForgotPasswordView(IdempotencyMixin, CreateAPIView):
+    query_budget = 7
     serializer_class = ForgotPasswordSerializer
     permission_classes = (IsNotAuthenticated, )
+    throttle_classes = (IPRateThrottle, EmailRateThrottle)
+    throttle_scope = 'forgot_password'
 
     def post(self, request, *args, **kwargs):
         serializer = self.serializer_class(data=request.data)
         serializer.is_valid(raise_exception=True)
         user = serializer.validated_data.get('email')
 
-        token = forgot_token.make_token(user)
-
-        message = render_to_string('confirmation_email.html', {
-            'site': get_current_site(self.request).domain,
-            'token': token,
-            'uid': urlsafe_base64_encode(force_bytes(user.pk))
-        })
-        send_mail(
-            subject='Forgot password',
-            message=message,
-            from_email='t998691@mvrht.net',
-            recipient_list=[user.email]
-
-        )
+        # a link sent in the last EMAIL_DEDUP_WINDOW is still valid, unless
+        # the password it was made for has changed since
+        scope = salted_hmac('main.views.forgot_password', user.password).hexdigest()
+        with deduplicate([user.email], 'forgot_password', scope) as recipients:
+            if recipients:
+                token = forgot_token.make_token(user)
+
+                message = render_email('confirmation_email.html', {
+                    'site': get_current_site(self.request).domain,
+                    'token': token,
+                    'uid': urlsafe_base64_encode(force_bytes(user.pk))
+                })
+                enqueue_mail(
+                    subject='Forgot password',
+                    message=message,
+                    from_email='t998691@mvrht.net',
+                    recipient_list=recipients
+
+                )
         return Response({'data': 'Check your email'}, status=status.HTTP_200_OK)
 
 
 class ConfirmView(APIView):
+    query_budget = 15
 
     def get(self, request, uidb64, token):
-        uid = force_text(urlsafe_base64_decode(uidb64))
-        user = get_object_or_404(get_user_model(), pk=uid)
-        if registration_token.check_token(user, token):
+        user = registration_verifier.get_user(uidb64, token)
+        if user:
             user.is_active = True
-            user.save()
-            login(request, user)
+            user.save(update_fields=['is_active'])
+            UserEmail.objects.filter(user=user).update(pending_confirmation=False)
+            registration_verifier.consume(uidb64, token)
+            login(request, user, backend='main.backends.EmailBackend')
 
             return JsonResponse(
                 {'url': reverse('main:create_team')},
@@ -140,22 +242,35 @@ class ConfirmView(APIView):
 
 
 class ForgotPasswordAccept(APIView):
+    query_budget = 9
 
     def get(self, request, uidb64, token):
-        uid = force_text(urlsafe_base64_decode(uidb64))
-        user = get_object_or_404(get_user_model(), pk=uid)
-        if forgot_token.check_token(user, token):
+        user = forgot_verifier.get_user(uidb64, token)
+        if user:
+            old_password = user.password
             new_password = get_user_model().objects.make_random_password()
+            # hashed before the transaction takes the write lock
             user.set_password(new_password)
-            user.save()
-
-            send_mail(
-                subject='New password',
-                message='New password is {}'.format(new_password),
-                from_email='t998691@mvrht.net',
-                recipient_list=[user.email]
-
-            )
+            with transaction.atomic():
+                # only one of concurrent requests with the link replaces
+                # the password the link was made for
+                updated = get_user_model().objects.filter(
+                    pk=user.pk, password=old_password
+                ).update(password=user.password)
+                if not updated:
+                    return JsonResponse(
+                        {'error': 'Invalid user'},
+                        status=status.HTTP_400_BAD_REQUEST
+                    )
+                enqueue_mail(
+                    subject='New password',
+                    message='New password is {}'.format(new_password),
+                    from_email='t998691@mvrht.net',
+                    recipient_list=[user.email]
+
+                )
+            usercache.invalidate(user.pk)
+            forgot_verifier.consume(uidb64, token)
 
             return JsonResponse(
                 {'url': reverse('main:login_user')},
@@ -169,6 +284,7 @@ class ForgotPasswordAccept(APIView):
 
 
 class SetPasswordView(UpdateAPIView):
+    query_budget = 8
     serializer_class = SetPasswordSerializer
     queryset = get_user_model().objects.all()
     permission_classes = (IsAuthenticated, )
@@ -177,7 +293,8 @@ class SetPasswordView(UpdateAPIView):
         return self.request.user
 
 
-class CreateTeamView(CreateAPIView):
+class CreateTeamView(IdempotencyMixin, CreateAPIView):
+    query_budget = 10
     serializer_class = CreateTeamSerializer
     queryset = Team.objects.all()
     permission_classes = (IsAuthenticated, IsHaveNotGotTeam)
@@ -187,33 +304,257 @@ class CreateTeamView(CreateAPIView):
         context['user'] = self.request.user
         return context
 
+    def create(self, request, *args, **kwargs):
+        serializer = self.get_serializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+        try:
+            atomic_with_retry(serializer.save)
+        except IntegrityError:
+            response = self.conflict(serializer.validated_data['name'])
+            if response is None:
+                raise
+            return response
+        return Response(serializer.data, status=status.HTTP_201_CREATED)
+
+    def conflict(self, name):
+        """
+        Response to a team creation that lost a race, to another request
+        of the same user or to another team with the same name, or that
+        found a dangling membership of the user. None for other integrity
+        errors.
+        """
+        user = self.request.user
+        # IsHaveNotGotTeam passed before the other request committed
+        user.__dict__.pop('_teams_cache', None)
+        db = router.db_for_write(Team)
+        team = Team.objects.using(db).filter(members=user).first()
+        if team is not None and team.name == name:
+            # a retry of the request that created the team
+            return Response(
+                self.get_serializer(team).data,
+                status=status.HTTP_201_CREATED
+            )
+        if team is not None:
+            return Response(
+                {'error': 'You already have a team'},
+                status=status.HTTP_400_BAD_REQUEST
+            )
+        if Team.objects.using(db).filter(name=name).exists():
+            return Response(
+                {'name': ['Team with this name already exists.']},
+                status=status.HTTP_409_CONFLICT
+            )
+        if Team.members.through.objects.using(db).filter(user=user).exists():
+            # the membership of a deleted team, left behind where the
+            # foreign key is not enforced
+            return Response(
+                {'error': 'Your membership refers to a deleted team'},
+                status=status.HTTP_409_CONFLICT
+            )
+        return None
 
-class InviteView(CreateAPIView):
+
+class InviteView(IdempotencyMixin, CreateAPIView):
+    query_budget = 10
     serializer_class = InviteSerializer
     permission_classes = (IsAuthenticated, IsHaveGotTeam)
 
+    def get_serializer_class(self):
+        if 'emails' in self.request.data:
+            return BulkInviteSerializer
+        return self.serializer_class
+
+    def get_team(self):
+        return get_teams(self.request.user)[0]
+
+    def render_invite(self, site, email):
+        team_id, team_name = self.get_team()
+        return render_email('invite_email.html', {
+            'site': site,
+            'username': self.request.user.username,
+            'team': team_name,
+            # only valid for the address it is sent to
+            'token': team_invite_token.make_token(team_id, email)
+        })
+
     def post(self, request, *args, **kwargs):
-        serializer = self.serializer_class(data=request.data)
+        serializer = self.get_serializer(data=request.data)
         serializer.is_valid(raise_exception=True)
+        if isinstance(serializer, BulkInviteSerializer):
+            return self.bulk_invite(serializer)
+
         email = serializer.validated_data['email']
-        message = render_to_string('invite_email.html', {
-            'site': get_current_site(self.request).domain,
-            'username': request.user.username,
-            'team': request.user.teams.first().name
-        })
-        send_mail(
-            subject='Invite to {}'.format(get_current_site(self.request).domain),
-            message=message,
-            from_email='t998691@mvrht.net',
-            recipient_list=[email, ]
+        with deduplicate([email], 'invite', self.get_team()[0]) as recipients:
+            if recipients:
+                site = get_current_site(self.request).domain
+                enqueue_mail(
+                    subject='Invite to {}'.format(site),
+                    message=self.render_invite(site, email),
+                    from_email='t998691@mvrht.net',
+                    recipient_list=recipients
+
+                )
+        return Response({'data': 'Email is sent'}, status=status.HTTP_200_OK)
 
+    def bulk_invite(self, serializer):
+        emails, errors = serializer.split_emails()
+        with deduplicate(emails, 'invite', self.get_team()[0]) as recipients:
+            if recipients:
+                site = get_current_site(self.request).domain
+                enqueue_bulk_mail(
+                    subject='Invite to {}'.format(site),
+                    messages=[
+                        (email, self.render_invite(site, email))
+                        for email in recipients
+                    ],
+                    from_email='t998691@mvrht.net'
+                )
+        results = [{'email': email, 'status': 'sent'} for email in emails]
+        results.extend(
+            {'email': email, 'status': 'failed', 'error': error}
+            for email, error in errors.items()
+        )
+        return Response({'results': results}, status=status.HTTP_200_OK)
+
+
+class TeamQuerysetMixin(object):
+    """
+    Staff see every team, other users only the teams they belong to.
+    """
+
+    def get_teams_queryset(self):
+        queryset = Team.objects.only('id', 'name', 'version')
+        if not self.request.user.is_staff:
+            queryset = queryset.filter(
+                pk__in=[pk for pk, _ in get_teams(self.request.user)]
+            )
+        return queryset
+
+
+class TeamConditionalMixin(TeamQuerysetMixin):
+    """
+    Answers conditional GETs from the team version alone, without loading
+    the team or its members.
+    """
+
+    def get(self, request, *args, **kwargs):
+        version = (
+            self.get_teams_queryset()
+            .filter(pk=self.kwargs['pk'])
+            .values_list('version', 'updated_at')
+            .first()
+        )
+        if version is None:
+            raise Http404
+        etag = '"team-{}-{}"'.format(self.kwargs['pk'], version[0])
+        last_modified = timegm(version[1].utctimetuple())
+
+        response = get_conditional_response(
+            request,
+            etag=etag,
+            last_modified=last_modified
+        )
+        if response is None:
+            response = super(TeamConditionalMixin, self).get(request, *args, **kwargs)
+        response['ETag'] = etag
+        response['Last-Modified'] = http_date(last_modified)
+        return response
+
+
+class TeamListView(TeamQuerysetMixin, ListAPIView):
+    query_budget = 5
+    serializer_class = TeamSerializer
+    permission_classes = (IsAuthenticated, )
+    pagination_class = IdCursorPagination
+
+    def get_queryset(self):
+        return self.get_teams_queryset().annotate(member_count=Count('members'))
+
+
+class TeamDetailView(TeamConditionalMixin, RetrieveAPIView):
+    query_budget = 5
+    serializer_class = TeamSerializer
+    permission_classes = (IsAuthenticated, )
+
+    def get_queryset(self):
+        return self.get_teams_queryset().annotate(member_count=Count('members'))
+
+
+class TeamMembersView(TeamConditionalMixin, ListAPIView):
+    query_budget = 5
+    serializer_class = MemberSerializer
+    permission_classes = (IsAuthenticated, )
+    pagination_class = IdCursorPagination
+
+    def get_queryset(self):
+        # access to the team is checked by TeamConditionalMixin.get
+        return get_user_model().objects.filter(teams=self.kwargs['pk']).only(
+            'id', 'email', 'first_name', 'last_name'
         )
-        return Response({'data': 'Email is sent'}, status=status.HTTP_200_OK)
 
 
 class LogoutUserView(GenericAPIView):
+    query_budget = 5
     permission_classes = (IsAuthenticated,)
 
     def get(self, request):
         logout(request)
         return Response({})
+
+
+class ThrottleStatsView(APIView):
+    """
+    Requests allowed and rejected by each rate limit, added up over every
+    process writing to METRICS_DIR, see main.metrics.
+    """
+    query_budget = 2
+    permission_classes = (IsAdminUser, )
+
+    def get(self, request):
+        data = {}
+        samples = metrics.collect()[metrics.throttle_requests.name]
+        for (scope, result), sample in sorted(samples.items()):
+            data.setdefault(scope, {'allowed': 0, 'rejected': 0})[result] = sample[0]
+        return Response(data)
+
+
+class ExportView(APIView):
+    """
+    Streams every team, or every membership, as NDJSON or CSV, gzipped
+    for clients that accept it. Rows are read in keyset batches while
+    the response is sent, so memory use does not grow with the tables.
+    The queries of the stream run after the view returns and are not
+    counted in its budget.
+    """
+    query_budget = 3
+    permission_classes = (IsAdminUser, )
+    batch_size = 1000
+
+    def get(self, request, kind, fmt):
+        compress = bool(re_accepts_gzip.search(request.META.get('HTTP_ACCEPT_ENCODING', '')))
+        response = StreamingHttpResponse(
+            export(kind, fmt, compress, self.batch_size),
+            content_type=CONTENT_TYPES[fmt]
+        )
+        response['Content-Disposition'] = 'attachment; filename="{}.{}"'.format(kind, fmt)
+        patch_vary_headers(response, ('Accept-Encoding', ))
+        if compress:
+            response['Content-Encoding'] = 'gzip'
+        return response
+
+
+class MetricsView(View):
+    """
+    Request, hashing, database, session and email timings of every worker
+    in the Prometheus text format, for clients in METRICS_ALLOWED_IPS.
+    """
+    query_budget = 0
+
+    def get(self, request):
+        allowed = getattr(settings, 'METRICS_ALLOWED_IPS', ())
+        if request.META.get('REMOTE_ADDR') not in allowed:
+            raise Http404
+        return HttpResponse(
+            metrics.exposition(),
+            content_type='text/plain; version=0.0.4; charset=utf-8'
+        )